@@ -5,28 +5,51 @@ Monitors configured directory for new .gcode files and syncs them to the Pi
 """
 
 import os
+import stat
 import sys
 import time
 import subprocess
 import shlex
 import logging
+import logging.handlers
+import queue
 import threading
 import re
+import atexit
+import errno
+import ipaddress
+import json
+import socket
 import shutil
+import signal
+import string
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from functools import wraps
+from functools import partial, wraps
 from typing import Dict, Any, Optional, Callable, Tuple, List
 from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler, FileSystemEvent
+from watchdog.observers.polling import PollingObserver
+from watchdog.events import (
+    EVENT_TYPE_CLOSED,
+    EVENT_TYPE_CREATED,
+    EVENT_TYPE_MODIFIED,
+    EVENT_TYPE_MOVED,
+    FileSystemEvent,
+    FileSystemEventHandler,
+)
 
 # Determine script directory
 SCRIPT_DIR = Path(__file__).parent.resolve()
 
 # Configuration constants
-FILE_SETTLE_DELAY = 1           # Seconds to wait for file write completion
+FILE_SETTLE_DELAY = 1           # Seconds without new events before a file is synced (non-inotify only)
+BATCH_WINDOW = 0.5              # Seconds to gather a burst of completed files into one rsync
+USB_REFRESH_MIN_INTERVAL = 5    # Minimum seconds between USB gadget refreshes
 RSYNC_TIMEOUT = 60              # Rsync network timeout (seconds)
 RSYNC_TOTAL_TIMEOUT = 120       # Maximum time for entire rsync operation (2 minutes)
 USB_REFRESH_TIMEOUT = 30        # USB gadget refresh timeout (seconds)
+SYNC_MAX_WORKERS = 4            # Maximum number of concurrent rsync transfers
 
 # File size limits (GCode files are typically 1-100 MB, rarely >500 MB)
 MAX_FILE_SIZE = 1024 * 1024 * 1024      # 1 GB (hard limit)
@@ -38,6 +61,13 @@ RETRY_MAX_ATTEMPTS = 3                   # Maximum retry attempts
 RETRY_INITIAL_DELAY = 2                  # Initial retry delay (seconds)
 RETRY_BACKOFF_MULTIPLIER = 2             # Exponential backoff multiplier
 
+# Config validation patterns (compiled once at import)
+_DANGEROUS_CHARS = re.compile(r'[$`;\|&<>(){}]')  # Shell metacharacters
+_PATH_TRAVERSAL = re.compile(r'\.\.')
+_REQUIRED_CONFIG_KEYS = ('WATCH_DIR', 'REMOTE_USER', 'REMOTE_HOST', 'REMOTE_PORT', 'REMOTE_PATH', 'LOG_FILE')
+# System directories LOG_FILE may never point into
+_FORBIDDEN_LOG_DIRS = tuple(Path(p) for p in ('/etc', '/var', '/usr', '/bin', '/sbin', '/boot'))
+
 
 def parse_rsync_stats(stdout: Optional[str]) -> Dict[str, Any]:
     """Parse rsync --stats output into a dictionary of values."""
@@ -114,9 +144,65 @@ def retry_on_failure(max_attempts: int = RETRY_MAX_ATTEMPTS, initial_delay: floa
         return wrapper
     return decorator
 
+def resolve_host(host: str) -> List[str]:
+    """Return the addresses `host` resolves to, in resolver preference order.
+
+    An empty list means the name could not be resolved.
+    """
+    try:
+        addr_info = socket.getaddrinfo(host, None, proto=socket.IPPROTO_TCP)
+    except (socket.gaierror, UnicodeError) as e:
+        logging.debug("Could not resolve %s: %s", host, e)
+        return []
+
+    return list(dict.fromkeys(info[4][0] for info in addr_info))
+
+
+def is_lan_host(host: str, addresses: Optional[List[str]] = None) -> bool:
+    """Return True if every address of `host` is private, link-local or loopback.
+
+    Resolution failures count as not-LAN so the transfer falls back to compression.
+    """
+    if addresses is None:
+        addresses = resolve_host(host)
+
+    # Strip any IPv6 zone index ("fe80::1%eth0") before parsing
+    parsed = {ipaddress.ip_address(address.split('%', 1)[0]) for address in addresses}
+    return bool(parsed) and all(addr.is_private or addr.is_link_local for addr in parsed)
+
+
+def _expand_config_value(value: str, env: Dict[str, str], home: str) -> str:
+    """Expand $VAR/${VAR} and a leading ~ the way the shell-sourced config would.
+
+    Unknown variables are left as-is, matching os.path.expandvars.
+    """
+    if '$' in value:
+        value = string.Template(value).safe_substitute(env)
+    if value == '~' or value.startswith('~/'):
+        return home + value[1:]
+    if value.startswith('~'):
+        return os.path.expanduser(value)  # ~user form needs a pwd lookup
+    return value
+
+
+def validate_watch_path(path: str, home: str) -> Path:
+    """Return `path` fully resolved, raising ValueError unless it lies within `home`.
+
+    Every component is resolved, so a symlinked parent directory cannot point
+    WATCH_DIR outside home. Home is resolved too, so the two compare like with like.
+    """
+    if not os.path.isabs(path):
+        raise ValueError(f"WATCH_DIR must be an absolute path (got: {path})")
+
+    watch_dir, home = os.path.realpath(path), os.path.realpath(home)
+    if watch_dir != home and not watch_dir.startswith(home.rstrip(os.sep) + os.sep):
+        raise ValueError(f"WATCH_DIR must be within user home directory ({home})\n  Got: {watch_dir}")
+    return Path(watch_dir)
+
+
 def load_config() -> Dict[str, str]:
-    """Load configuration from config.local"""
-    config_file = SCRIPT_DIR / 'config.local'
+    """Load configuration from config.local, or the file named by GCODE_MONITOR_CONFIG"""
+    config_file = Path(os.environ.get('GCODE_MONITOR_CONFIG') or SCRIPT_DIR / 'config.local')
 
     if not config_file.exists():
         print(f"ERROR: Configuration file not found: {config_file}", file=sys.stderr)
@@ -130,31 +216,42 @@ def load_config() -> Dict[str, str]:
         sys.exit(1)
 
     config = {}
-    with open(config_file, 'r') as f:
-        for line in f:
-            line = line.strip()
-            # Skip comments and empty lines
-            if line.startswith('#') or not line or '=' not in line:
-                continue
-            # Parse KEY="VALUE" or KEY=VALUE
-            key, value = line.split('=', 1)
-            key = key.strip()
-            value = value.strip().strip('"').strip("'")
-            # Expand shell variables like $HOME
-            value = os.path.expandvars(value)
-            value = os.path.expanduser(value)
-            config[key] = value
+    # Snapshot the environment and home directory once for all lines
+    env = dict(os.environ)
+    home = os.path.expanduser('~')
+    # Small file: read it in one call rather than through the buffered line iterator
+    for line in config_file.read_text(encoding='utf-8', errors='replace').splitlines():
+        line = line.strip()
+        # Skip comments and empty lines
+        if line.startswith('#') or not line or '=' not in line:
+            continue
+        # Parse KEY="VALUE" or KEY=VALUE
+        key, value = line.split('=', 1)
+        key = key.strip()
+        value = value.strip().strip('"').strip("'")
+        # Expand shell variables like $HOME
+        config[key] = _expand_config_value(value, env, home)
 
     # Validate required variables
-    required = ['WATCH_DIR', 'REMOTE_USER', 'REMOTE_HOST', 'REMOTE_PORT', 'REMOTE_PATH', 'LOG_FILE']
-    for key in required:
+    for key in _REQUIRED_CONFIG_KEYS:
         if key not in config:
             print(f"ERROR: Required variable {key} is not set in {config_file}", file=sys.stderr)
             sys.exit(1)
 
-    # Validate config values to prevent injection attacks
-    import re
+    # Optional: compression mode (auto = compress only when the Pi is off the LAN)
+    config['RSYNC_COMPRESS'] = config.get('RSYNC_COMPRESS', 'auto').lower()
+    if config['RSYNC_COMPRESS'] not in ('auto', 'yes', 'no'):
+        print(f"ERROR: RSYNC_COMPRESS must be auto, yes or no (got: {config['RSYNC_COMPRESS']})", file=sys.stderr)
+        sys.exit(1)
 
+    # Optional: private key for the Pi (default: ssh's own identity search)
+    identity_file = config.get('SSH_IDENTITY_FILE', '')
+    if identity_file and not Path(identity_file).is_file():
+        print(f"ERROR: SSH_IDENTITY_FILE not found: {identity_file}", file=sys.stderr)
+        sys.exit(1)
+    config['SSH_IDENTITY_FILE'] = identity_file
+
+    # Validate config values to prevent injection attacks
     # Port must be numeric
     if not config['REMOTE_PORT'].isdigit():
         print(f"ERROR: REMOTE_PORT must be numeric (got: {config['REMOTE_PORT']})", file=sys.stderr)
@@ -166,43 +263,27 @@ def load_config() -> Dict[str, str]:
         sys.exit(1)
 
     # Host, user, and path must not contain dangerous characters
-    dangerous_chars = re.compile(r'[$`;\|&<>(){}]')
-
-    if dangerous_chars.search(config['REMOTE_HOST']):
+    if _DANGEROUS_CHARS.search(config['REMOTE_HOST']):
         print("ERROR: REMOTE_HOST contains invalid characters", file=sys.stderr)
         sys.exit(1)
 
-    if dangerous_chars.search(config['REMOTE_USER']):
+    if _DANGEROUS_CHARS.search(config['REMOTE_USER']):
         print("ERROR: REMOTE_USER contains invalid characters", file=sys.stderr)
         sys.exit(1)
 
-    if dangerous_chars.search(config['REMOTE_PATH']):
+    if _DANGEROUS_CHARS.search(config['REMOTE_PATH']):
         print("ERROR: REMOTE_PATH contains invalid characters", file=sys.stderr)
         sys.exit(1)
 
     # Validate WATCH_DIR and LOG_FILE paths (defense in depth)
-    from pathlib import Path
-
     # Validate WATCH_DIR is absolute and within user home
     try:
-        watch_dir = Path(config['WATCH_DIR']).resolve()
-    except Exception as e:
-        print(f"ERROR: Invalid WATCH_DIR path: {config['WATCH_DIR']}: {e}", file=sys.stderr)
+        validate_watch_path(config['WATCH_DIR'], home)
+    except ValueError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
         sys.exit(1)
 
-    user_home = Path.home()
-
-    if not watch_dir.is_absolute():
-        print(f"ERROR: WATCH_DIR must be an absolute path (got: {config['WATCH_DIR']})", file=sys.stderr)
-        sys.exit(1)
-
-    # Ensure WATCH_DIR is within user's home directory
-    try:
-        watch_dir.relative_to(user_home)
-    except ValueError:
-        print(f"ERROR: WATCH_DIR must be within user home directory ({user_home})", file=sys.stderr)
-        print(f"  Got: {watch_dir}", file=sys.stderr)
-        sys.exit(1)
+    user_home = Path(home)
 
     # Validate LOG_FILE path
     try:
@@ -212,9 +293,7 @@ def load_config() -> Dict[str, str]:
         sys.exit(1)
 
     # Prevent writing to system directories
-    forbidden_paths = [Path('/etc'), Path('/var'), Path('/usr'), Path('/bin'), Path('/sbin'), Path('/boot')]
-
-    for forbidden in forbidden_paths:
+    for forbidden in _FORBIDDEN_LOG_DIRS:
         try:
             log_file.relative_to(forbidden)
             print(f"ERROR: LOG_FILE cannot be in system directory ({forbidden})", file=sys.stderr)
@@ -232,12 +311,11 @@ def load_config() -> Dict[str, str]:
         sys.exit(1)
 
     # Check for path traversal sequences
-    path_traversal = re.compile(r'\.\.')
-    if path_traversal.search(config['WATCH_DIR']):
+    if _PATH_TRAVERSAL.search(config['WATCH_DIR']):
         print("ERROR: WATCH_DIR contains path traversal sequence (..)", file=sys.stderr)
         sys.exit(1)
 
-    if path_traversal.search(config['LOG_FILE']):
+    if _PATH_TRAVERSAL.search(config['LOG_FILE']):
         print("ERROR: LOG_FILE contains path traversal sequence (..)", file=sys.stderr)
         sys.exit(1)
 
@@ -251,6 +329,118 @@ REMOTE_HOST = config['REMOTE_HOST']
 REMOTE_PORT = config['REMOTE_PORT']
 REMOTE_PATH = config['REMOTE_PATH']
 LOG_FILE = config['LOG_FILE']
+RSYNC_COMPRESS = config['RSYNC_COMPRESS']
+SSH_IDENTITY_FILE = config['SSH_IDENTITY_FILE']
+
+# WATCH_DIR is fixed after config load; normalize it once instead of per event
+ABS_WATCH_DIR = os.path.abspath(WATCH_DIR)
+
+# Resolve external tools once so each sync execs them directly instead of
+# searching PATH on every spawn
+RSYNC_BIN = shutil.which("rsync") or "rsync"
+SSH_BIN = shutil.which("ssh") or "ssh"
+
+
+def connect_host_for(addresses: List[str]) -> str:
+    """Return the host ssh should connect to, given REMOTE_HOST's addresses.
+
+    Only a single address is pinned. With several (e.g. an unreachable IPv6
+    address listed first) or none, ssh gets the name and tries each in turn.
+    """
+    return addresses[0] if len(addresses) == 1 else REMOTE_HOST
+
+
+# Resolve REMOTE_HOST once so ssh and rsync skip DNS/mDNS lookups on every sync.
+# A connection failure re-resolves it (see reresolve_remote_host) in case the
+# Pi's lease changed.
+REMOTE_ADDRESSES = resolve_host(REMOTE_HOST)
+REMOTE_CONNECT_HOST = connect_host_for(REMOTE_ADDRESSES)
+# rsync needs IPv6 literals bracketed in user@host:path
+REMOTE_RSYNC_HOST = f"[{REMOTE_CONNECT_HOST}]" if ':' in REMOTE_CONNECT_HOST else REMOTE_CONNECT_HOST
+REMOTE_TARGET = f"{REMOTE_USER}@{REMOTE_CONNECT_HOST}"
+SSH_CONNECTION_FAILED = 255  # ssh's exit status (passed through by rsync) when it cannot connect
+# Target the master connection was opened with; ControlPath's %C hashes it, so
+# -O exit must use this one even after reresolve_remote_host() moves REMOTE_TARGET
+SSH_MASTER_TARGET: Optional[str] = None
+
+
+def reresolve_remote_host() -> bool:
+    """Look REMOTE_HOST up again after ssh could not connect to the cached address.
+
+    A DHCP or mDNS address change would otherwise fail every sync until restart.
+    If the name no longer resolves to exactly one address, ssh is handed the name.
+
+    Returns:
+        bool: True if the connect address changed
+    """
+    global REMOTE_CONNECT_HOST, REMOTE_RSYNC_HOST, REMOTE_TARGET
+    connect_host = connect_host_for(resolve_host(REMOTE_HOST))
+    if connect_host == REMOTE_CONNECT_HOST:
+        return False
+
+    logging.warning(f"{REMOTE_HOST} now connects via {connect_host} (was {REMOTE_CONNECT_HOST})")
+    REMOTE_CONNECT_HOST = connect_host
+    REMOTE_RSYNC_HOST = f"[{connect_host}]" if ':' in connect_host else connect_host
+    REMOTE_TARGET = f"{REMOTE_USER}@{connect_host}"
+    return True
+
+
+def rsync_destination() -> str:
+    """Return the user@host:path rsync target for the current connect address."""
+    remote_dir = REMOTE_PATH if REMOTE_PATH.endswith('/') else f'{REMOTE_PATH}/'
+    return f"{REMOTE_USER}@{REMOTE_RSYNC_HOST}:{shlex.quote(remote_dir)}"
+
+# Keep checking the host key under the configured name; known_hosts records
+# non-default ports as "[host]:port"
+SSH_HOST_KEY_ALIAS = REMOTE_HOST if int(REMOTE_PORT) == 22 else f"[{REMOTE_HOST}]:{REMOTE_PORT}"
+
+# On a LAN the link outruns the CPU cost of compression, and a freshly sliced
+# file has no remote copy to delta against, so send it whole and uncompressed
+REMOTE_IS_LAN = is_lan_host(REMOTE_HOST, REMOTE_ADDRESSES)
+if RSYNC_COMPRESS == 'auto':
+    RSYNC_USE_COMPRESSION = not REMOTE_IS_LAN
+else:
+    RSYNC_USE_COMPRESSION = RSYNC_COMPRESS == 'yes'
+# No -v: stdout is captured for the --stats summary and the per-file listing is never read
+RSYNC_TRANSFER_FLAGS = ["-az", "--compress-level=3"] if RSYNC_USE_COMPRESSION else ["-aW"]
+
+# SSH connection multiplexing: a master connection opened at startup is shared by
+# every rsync and USB refresh, so syncs skip the TCP handshake and key exchange.
+# The socket lives under ~/.local, which stays writable in the systemd sandbox;
+# %C (hash of user/host/port) keeps the path below the Unix socket length limit.
+STATE_DIR = Path.home() / '.local' / 'state' / 'gcode-monitor'
+SSH_CONTROL_DIR = STATE_DIR
+SSH_CONTROL_PATH = str(SSH_CONTROL_DIR / 'cm-%C')
+SSH_CONTROL_PERSIST = '10m'         # Keep idle master connection alive this long
+SSH_MASTER_TIMEOUT = 15             # Seconds to wait for the master to authenticate
+
+# (size, mtime) of every file already on the printer, kept across restarts
+SYNC_STATE_FILE = STATE_DIR / 'sync_state.json'
+
+SSH_OPTIONS = [
+    "-p", REMOTE_PORT,
+    # Unattended daemon: never prompt, and go straight to key auth instead of
+    # offering GSSAPI/keyboard-interactive first
+    "-o", "BatchMode=yes",
+    "-o", "PreferredAuthentications=publickey",
+    "-o", "StrictHostKeyChecking=yes",
+    "-o", f"HostKeyAlias={SSH_HOST_KEY_ALIAS}",
+    "-o", "ConnectTimeout=10",
+    "-o", "ServerAliveInterval=5",
+    "-o", "ServerAliveCountMax=3",
+    "-o", f"ControlPath={SSH_CONTROL_PATH}",
+]
+if SSH_IDENTITY_FILE:
+    # Offer only this key, not every key in the agent, so a crowded agent
+    # cannot use up the server's MaxAuthTries before the right one is tried
+    SSH_OPTIONS += ["-i", SSH_IDENTITY_FILE, "-o", "IdentitiesOnly=yes"]
+
+# Clients reuse the master; if it has gone away (network drop, persist timeout),
+# the next client becomes the new persistent master instead of connecting one-off
+SSH_CLIENT_OPTIONS = SSH_OPTIONS + [
+    "-o", "ControlMaster=auto",
+    "-o", f"ControlPersist={SSH_CONTROL_PERSIST}",
+]
 
 # Ensure log directory exists with secure permissions before configuring logging
 log_path = Path(LOG_FILE)
@@ -259,143 +449,525 @@ if not log_dir.exists():
     log_dir.mkdir(parents=True, mode=0o700, exist_ok=True)
 
 # Setup logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(LOG_FILE),
-        logging.StreamHandler(sys.stdout)
-    ]
+# Observer and sync threads only enqueue records; a single listener thread does
+# the file and console I/O so slow disk writes never stall event handling.
+log_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+log_handlers = [logging.FileHandler(LOG_FILE), logging.StreamHandler(sys.stdout)]
+for log_handler in log_handlers:
+    log_handler.setFormatter(log_formatter)
+
+log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+log_listener = logging.handlers.QueueListener(
+    log_queue, *log_handlers, respect_handler_level=True
 )
+# The queue side only merges args into the message; the listener's handlers
+# apply the real format
+queue_handler = logging.handlers.QueueHandler(log_queue)
+queue_handler.setFormatter(logging.Formatter('%(message)s'))
+logging.basicConfig(level=logging.INFO, handlers=[queue_handler])
+log_listener.start()
+# Flush queued records on every exit path, including sys.exit() and uncaught
+# exceptions, so the message explaining an early exit is not lost
+atexit.register(log_listener.stop)
+
+# Network filesystems only raise inotify events for changes made on this host,
+# so files written by another client (e.g. a slicer on a NAS) would go unseen
+_NETWORK_FSTYPES = frozenset({'cifs', 'smbfs', 'smb3', 'nfs', 'nfs4', 'fuse.sshfs'})
+_MOUNTS_ESCAPE = re.compile(r'\\([0-7]{3})')  # /proc/mounts octal escapes (\040 = space)
+
+
+def filesystem_type(path: str, mounts_file: str = '/proc/mounts') -> Optional[str]:
+    """Return the type of the filesystem `path` lives on, or None if unknown."""
+    path = os.path.realpath(path)
+    mount_point, fstype = '', None
+    try:
+        with open(mounts_file, encoding='utf-8') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                candidate = _MOUNTS_ESCAPE.sub(lambda m: chr(int(m.group(1), 8)), fields[1])
+                # Longest matching mount point wins; later entries over-mount earlier ones
+                if (len(candidate) >= len(mount_point)
+                        and os.path.commonpath([path, candidate]) == candidate):
+                    mount_point, fstype = candidate, fields[2]
+    except (OSError, ValueError) as e:
+        logging.debug("Could not read mount table %s: %s", mounts_file, e)
+        return None
+
+    return fstype
+
+
+def select_observer(path: str) -> type:
+    """Pick inotify (the platform default) unless `path` is on a network filesystem."""
+    fstype = filesystem_type(path)
+    if fstype in _NETWORK_FSTYPES:
+        logging.info(f"{path} is on a {fstype} mount; using polling observer")
+        return PollingObserver
+    return Observer
+
+
+def close_events_supported(observer_class: type) -> bool:
+    """Return True if `observer_class` delivers FileClosedEvent.
+
+    Only the inotify backend emits it (IN_CLOSE_WRITE); polling, FSEvents and
+    kqueue observers still need the settle delay.
+    """
+    return observer_class.__module__ == "watchdog.observers.inotify"
+
+
+# Queued by close() to end the dispatcher thread
+_STOP_DISPATCHER = object()
+
 
 class GCodeHandler(FileSystemEventHandler):
     """Handler for .gcode file events"""
 
-    def __init__(self) -> None:
-        self.syncing = set()  # Track files currently being synced
-        self.syncing_lock = threading.Lock()  # Prevent race conditions
+    def __init__(self, close_events: bool = False, state_file: Optional[Path] = None) -> None:
+        # With close events, the kernel tells us when a write has finished, so
+        # modify events only postpone files that have not been closed yet.
+        # Creations still count: a file moved in from another directory arrives
+        # as a created event and never gets a close event, so it settles instead.
+        self.close_events = close_events
+        self._event_methods: Dict[str, Callable[[FileSystemEvent], None]] = {
+            EVENT_TYPE_CREATED: self.on_created,
+            EVENT_TYPE_MOVED: self.on_moved,
+            EVENT_TYPE_CLOSED: self.on_closed,
+            EVENT_TYPE_MODIFIED: self._postpone if close_events else self.on_modified,
+        }
+        # Event threads only enqueue updates; the dispatcher thread applies them
+        # and owns pending, _complete and in_flight, so none of those need a lock
+        self._work: "queue.Queue[Any]" = queue.Queue()
+        self._dispatcher: Optional[threading.Thread] = None
+        # Files currently being synced, mapped to their batch's future
+        self.in_flight: Dict[str, Future] = {}
+        # (size, mtime_ns) of each file as of its last successful sync; files
+        # that still match are not sent again. Persisted to state_file if given.
+        self.state_file = state_file
+        self.synced: Dict[str, Tuple[int, int]] = self._load_sync_state()
+        self.syncing_lock = threading.Lock()  # Guards the USB refresh bookkeeping below
+        # Files waiting for their events to settle, mapped to the monotonic time
+        # at which they become due. Kept in event order so batches preserve it.
+        self.pending: "OrderedDict[str, float]" = OrderedDict()
+        # Pending files known to be fully written (closed or renamed into place).
+        # They ride along with whichever batch flushes next.
+        self._complete: set = set()
+        # Transfers run off the observer thread so a large upload does not hold up others
+        self.executor = ThreadPoolExecutor(max_workers=SYNC_MAX_WORKERS, thread_name_prefix="sync")
+        # USB refresh is coalesced: it runs once when the last in-flight sync finishes
+        self._active_syncs = 0
+        self._refresh_pending = False
+        self._last_refresh = None
+
+    def dispatch(self, event: FileSystemEvent) -> None:
+        """Route relevant events, dropping everything else as cheaply as possible.
+
+        Slicers and editors write temp files (.gcode.tmp, .swp, ~) next to the
+        real output, so most events are discarded here, before watchdog's
+        generic dispatch and the per-event handlers run.
+        """
+        method = self._event_methods.get(event.event_type)
+        if method is None or event.is_directory:
+            return
+        path = event.dest_path if event.event_type == EVENT_TYPE_MOVED else event.src_path
+        if path.endswith('.gcode'):
+            method(event)
 
     def on_created(self, event: FileSystemEvent) -> None:
         """Called when a file is created"""
-        if not event.is_directory and event.src_path.endswith('.gcode'):
-            self.sync_file(event.src_path)
+        self._schedule(event.src_path)
 
     def on_moved(self, event: FileSystemEvent) -> None:
         """Called when a file is moved into the directory"""
-        if not event.is_directory and event.dest_path.endswith('.gcode'):
-            self.sync_file(event.dest_path)
+        # Atomic-rename saves: the file is complete once it appears, no settling needed
+        self._schedule(event.dest_path, delay=BATCH_WINDOW, complete=True)
 
     def on_modified(self, event: FileSystemEvent) -> None:
         """Called when a file is modified (handles saves from some editors)"""
-        if not event.is_directory and event.src_path.endswith('.gcode'):
-            self.sync_file(event.src_path)
+        # Polling backends also report attribute-only changes and the trailing
+        # events of a save that was already synced; skip if the content is unchanged
+        synced = self.synced.get(event.src_path)
+        if synced is not None:
+            try:
+                file_stat = os.stat(event.src_path)
+                if (file_stat.st_size, file_stat.st_mtime_ns) == synced:
+                    return
+            except OSError:
+                pass  # Let validation report a vanished file
+        self._schedule(event.src_path)
+
+    def _postpone(self, event: FileSystemEvent) -> None:
+        """Push back a created file that is still being written (close-event mode)."""
+        deadline = time.monotonic() + FILE_SETTLE_DELAY
+        self._work.put(partial(self._extend_settle, event.src_path, deadline))
+
+    def _extend_settle(self, file_path: str, deadline: float) -> None:
+        """Move a not-yet-closed pending file's deadline. Dispatcher thread only."""
+        # Files not pending will get a close event; closed ones are already complete
+        if file_path in self.pending and file_path not in self._complete:
+            self.pending[file_path] = deadline
+
+    def on_closed(self, event: FileSystemEvent) -> None:
+        """Called when a writer closes the file (inotify IN_CLOSE_WRITE, Linux only)"""
+        # The kernel reports the write is complete, so skip the settle window
+        self._schedule(event.src_path, delay=BATCH_WINDOW, complete=True)
+
+    def _schedule(self, file_path: str, delay: float = FILE_SETTLE_DELAY, complete: bool = False) -> None:
+        """Queue a file to be synced once its events have been quiet for `delay` seconds.
+
+        Every new event for a path pushes its deadline back, so the burst of
+        create/modify events produced by a single save results in one sync.
+        Complete files are also swept into any earlier batch, so a slicer
+        exporting several files at once produces a single rsync.
+        """
+        deadline = time.monotonic() + delay
+        self._work.put(partial(self._set_pending, file_path, deadline, complete))
+
+    def _set_pending(self, file_path: str, deadline: float, complete: bool) -> None:
+        """Record a file's new deadline. Dispatcher thread only."""
+        self.pending[file_path] = deadline
+        self.pending.move_to_end(file_path)
+        if complete:
+            self._complete.add(file_path)
+        else:
+            self._complete.discard(file_path)
+
+    def start(self) -> None:
+        """Start the dispatcher thread that turns queued events into rsync batches."""
+        self._dispatcher = threading.Thread(target=self._run_dispatcher, name="sync-dispatcher", daemon=True)
+        self._dispatcher.start()
+
+    def _run_dispatcher(self) -> None:
+        """Apply queued updates and submit batches as their files come due."""
+        while True:
+            try:
+                action = self._work.get(timeout=self._seconds_until_due())
+            except queue.Empty:
+                action = None
+            if not self._drain(action):
+                return
+            self._flush()
 
-    def sync_file(self, file_path: str) -> None:
-        """Sync a file to the remote server"""
-        # Thread-safe check and add
+    def _drain(self, action: Any = None) -> bool:
+        """Apply `action` and every update already queued behind it.
+
+        Returns:
+            bool: False once close() has asked the dispatcher to stop
+        """
+        while True:
+            if action is _STOP_DISPATCHER:
+                return False
+            if action is not None:
+                action()
+            try:
+                action = self._work.get_nowait()
+            except queue.Empty:
+                return True
+
+    def _seconds_until_due(self) -> Optional[float]:
+        """Time until the next waiting file is due, or None if nothing is waiting."""
+        waiting = [deadline for path, deadline in self.pending.items() if path not in self.in_flight]
+        if not waiting:
+            return None
+        return max(min(waiting) - time.monotonic(), 0)
+
+    def _flush(self) -> None:
+        """Sync every pending file whose settle period has elapsed. Dispatcher thread only."""
+        now = time.monotonic()
+
+        # Files still being uploaded stay pending; once their batch finishes
+        # they are picked up again so the newer contents are sent afterwards
+        waiting = [(path, deadline) for path, deadline in self.pending.items() if path not in self.in_flight]
+        if not any(deadline <= now for _, deadline in waiting):
+            return
+        due = [path for path, deadline in waiting if deadline <= now or path in self._complete]
+
+        for file_path in due:
+            del self.pending[file_path]
+            self._complete.discard(file_path)
+
+        # Everything that settled together goes out as one rsync batch
+        future = self.executor.submit(self.sync_files, due)
+        for file_path in due:
+            self.in_flight[file_path] = future
+        future.add_done_callback(partial(self._batch_done, due))
+
+    def _batch_done(self, file_paths: List[str], future: Future) -> None:
+        """Hand a finished batch back to the dispatcher (runs on the worker thread)."""
+        self._work.put(partial(self._release_batch, file_paths, future))
+
+    def _release_batch(self, file_paths: List[str], future: Future) -> None:
+        """Forget a finished batch's files. Dispatcher thread only."""
+        for file_path in file_paths:
+            if self.in_flight.get(file_path) is future:
+                del self.in_flight[file_path]
+
+    def close(self) -> None:
+        """Stop scheduling syncs and wait for in-flight transfers to finish.
+
+        Files still settling are not synced.
+        """
+        if self._dispatcher is not None:
+            self._work.put(_STOP_DISPATCHER)
+            self._dispatcher.join()
+            self._dispatcher = None
+
+        if self.pending:
+            logging.warning(f"Discarding {len(self.pending)} file(s) that had not settled yet")
+            self.pending.clear()
+            self._complete.clear()
+
+        self.executor.shutdown(wait=True)
+        self.save_sync_state()
+
+    def _load_sync_state(self) -> Dict[str, Tuple[int, int]]:
+        """Load the synced-file records saved by a previous run."""
+        if self.state_file is None:
+            return {}
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                records = json.load(f)
+            return {path: (int(size), int(mtime_ns)) for path, (size, mtime_ns) in records.items()}
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError, TypeError, AttributeError) as e:
+            logging.warning(f"Ignoring unreadable sync state {self.state_file}: {e}")
+            return {}
+
+    def save_sync_state(self) -> None:
+        """Write synced-file records for files that still exist, replacing the old state atomically."""
+        if self.state_file is None:
+            return
+        records = {path: list(record) for path, record in self.synced.items() if os.path.exists(path)}
+        tmp_file = self.state_file.with_suffix('.tmp')
+        try:
+            self.state_file.parent.mkdir(parents=True, mode=0o700, exist_ok=True)
+            with open(os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w', encoding='utf-8') as f:
+                json.dump(records, f)
+            os.replace(tmp_file, self.state_file)
+        except OSError as e:
+            logging.warning(f"Could not save sync state to {self.state_file}: {e}")
+
+    def _refresh_if_last(self) -> Optional[bool]:
+        """Refresh the USB gadget unless other batches are still in flight.
+
+        When another batch is running, the refresh is deferred to whichever one
+        finishes last, so a burst of files produces a single USB refresh.
+
+        Returns:
+            Optional[bool]: Refresh result, or None if the refresh was deferred
+        """
         with self.syncing_lock:
-            if file_path in self.syncing:
-                return
-            self.syncing.add(file_path)
+            self._refresh_pending = True
+            if self._active_syncs > 1:
+                return None
+
+        return self._run_refresh()
+
+    def _run_refresh(self) -> bool:
+        """Refresh the USB gadget, waiting out USB_REFRESH_MIN_INTERVAL first.
+
+        The caller still counts as an active sync while it waits, so batches
+        finishing in the meantime defer to it and share this one refresh.
+
+        Returns:
+            bool: Refresh result
+        """
+        if self._last_refresh is not None:
+            wait = self._last_refresh + USB_REFRESH_MIN_INTERVAL - time.monotonic()
+            if wait > 0:
+                logging.info(f"Delaying USB refresh {wait:.1f}s to coalesce with recent uploads")
+                time.sleep(wait)
 
+        with self.syncing_lock:
+            self._refresh_pending = False
+            self._last_refresh = time.monotonic()
+
+        return self.refresh_usb_gadget()
+
+    def _validate_file(self, file_path: str) -> Optional[Tuple[str, os.stat_result]]:
+        """Run the security and size checks for a file about to be synced.
+
+        Returns:
+            Optional[Tuple[str, os.stat_result]]: Absolute path and its lstat()
+            result, or None if the file must not be synced (the reason is logged)
+        """
+        # Security: Validate file path is within watch directory
+        # commonpath compares whole path components, so trailing slashes or a
+        # sibling like "Desktop2" cannot fool it the way a string prefix can
+        abs_file_path = os.path.abspath(file_path)
+
+        if (abs_file_path == ABS_WATCH_DIR
+                or os.path.commonpath([abs_file_path, ABS_WATCH_DIR]) != ABS_WATCH_DIR):
+            logging.error(f"Security: File outside watch directory: {file_path}")
+            logging.error(f"  File path: {abs_file_path}")
+            logging.error(f"  Watch dir: {ABS_WATCH_DIR}")
+            return None
+
+        # Security: Check it's a regular file (not symlink, directory, device, etc.)
+        # A single lstat() answers existence, type and size without following symlinks
         try:
-            # Wait a moment to ensure file is fully written
-            time.sleep(FILE_SETTLE_DELAY)
+            file_stat = os.lstat(abs_file_path)
+        except FileNotFoundError:
+            logging.warning(f"File no longer exists: {file_path}")
+            return None
+        except OSError as e:
+            logging.error(f"Cannot stat file: {file_path}: {e}")
+            return None
 
-            # Security: Validate file path is within watch directory
-            abs_file_path = os.path.abspath(file_path)
-            abs_watch_dir = os.path.abspath(WATCH_DIR)
+        if stat.S_ISLNK(file_stat.st_mode):
+            logging.error(f"Security: Refusing to sync symlink: {file_path}")
+            return None
 
-            if not abs_file_path.startswith(abs_watch_dir + os.sep):
-                logging.error(f"Security: File outside watch directory: {file_path}")
-                logging.error(f"  File path: {abs_file_path}")
-                logging.error(f"  Watch dir: {abs_watch_dir}")
-                return
+        if not stat.S_ISREG(file_stat.st_mode):
+            logging.warning(f"Skipping non-regular file: {file_path}")
+            return None
 
-            # Security: Check it's a regular file (not symlink, directory, device, etc.)
-            if not os.path.exists(abs_file_path):
-                logging.warning(f"File no longer exists: {file_path}")
-                return
+        # Security: Validate file extension (defense in depth)
+        if not abs_file_path.endswith('.gcode'):
+            logging.warning(f"Skipping non-gcode file: {file_path}")
+            return None
 
-            if os.path.islink(abs_file_path):
-                logging.error(f"Security: Refusing to sync symlink: {file_path}")
-                return
+        # Validate file size to prevent DoS
+        file_size = file_stat.st_size
 
-            if not os.path.isfile(abs_file_path):
-                logging.warning(f"Skipping non-regular file: {file_path}")
-                return
+        if file_size < MIN_FILE_SIZE:
+            logging.warning(f"Skipping empty file: {file_path}")
+            return None
 
-            # Security: Validate file extension (defense in depth)
-            if not abs_file_path.endswith('.gcode'):
-                logging.warning(f"Skipping non-gcode file: {file_path}")
-                return
+        if file_size > MAX_FILE_SIZE:
+            logging.error(f"File too large: {file_path} ({file_size / (1024*1024):.2f} MB)")
+            logging.error(f"Maximum allowed size: {MAX_FILE_SIZE / (1024*1024):.2f} MB")
+            return None
 
-            # Validate file size to prevent DoS
-            try:
-                file_size = os.path.getsize(abs_file_path)
-            except OSError as e:
-                logging.error(f"Cannot determine file size: {file_path}: {e}")
-                return
+        if file_size > WARN_FILE_SIZE:
+            logging.warning(f"Large file detected: {file_path} ({file_size / (1024*1024):.2f} MB)")
+            logging.warning("This may take several minutes to sync")
 
-            if file_size < MIN_FILE_SIZE:
-                logging.warning(f"Skipping empty file: {file_path}")
-                return
+        return abs_file_path, file_stat
 
-            if file_size > MAX_FILE_SIZE:
-                logging.error(f"File too large: {file_path} ({file_size / (1024*1024):.2f} MB)")
-                logging.error(f"Maximum allowed size: {MAX_FILE_SIZE / (1024*1024):.2f} MB")
-                return
+    def _revalidate_file(self, file_path: str, abs_file_path: str, file_stat: os.stat_result) -> bool:
+        """Check that a validated file is still the same regular file.
 
-            if file_size > WARN_FILE_SIZE:
-                logging.warning(f"Large file detected: {file_path} ({file_size / (1024*1024):.2f} MB)")
-                logging.warning("This may take several minutes to sync")
+        O_NOFOLLOW makes the kernel refuse a symlink atomically, and comparing the
+        inode with the validated one catches a file swapped in after validation.
 
-            logging.info(f"Syncing file: {abs_file_path} ({file_size / (1024*1024):.2f} MB)")
+        Returns:
+            bool: True if the file may still be synced
+        """
+        try:
+            fd = os.open(abs_file_path, os.O_RDONLY | os.O_NOFOLLOW | os.O_NONBLOCK)
+        except OSError as e:
+            if e.errno == errno.ELOOP:
+                logging.error(f"Security: File became symlink after validation: {file_path}")
+            else:
+                logging.error(f"Security: Cannot re-open file after validation: {file_path}: {e}")
+            return False
+
+        try:
+            current_stat = os.fstat(fd)
+        finally:
+            os.close(fd)
+
+        if not stat.S_ISREG(current_stat.st_mode):
+            logging.error(f"Security: File changed type after validation: {file_path}")
+            return False
+
+        if (current_stat.st_dev, current_stat.st_ino) != (file_stat.st_dev, file_stat.st_ino):
+            logging.error(f"Security: File was replaced after validation: {file_path}")
+            return False
+
+        return True
+
+    def sync_file(self, file_path: str) -> None:
+        """Sync a single file to the remote server"""
+        self.sync_files([file_path])
+
+    def sync_files(self, file_paths: List[str]) -> None:
+        """Sync a batch of files to the remote server with a single rsync invocation"""
+        # _flush never hands out a file that is still in flight, so no claim is needed here
+        claimed = list(dict.fromkeys(file_paths))
+        if not claimed:
+            return
+
+        with self.syncing_lock:
+            self._active_syncs += 1
+
+        batch_label = ", ".join(os.path.basename(path) for path in claimed)
+
+        try:
+            validated = []
+            for file_path in claimed:
+                checked = self._validate_file(file_path)
+                if checked is None:
+                    continue
+                # Fast path: identical size and mtime to what we last uploaded
+                file_stat = checked[1]
+                if self.synced.get(file_path) == (file_stat.st_size, file_stat.st_mtime_ns):
+                    logging.info(f"Skipping unchanged file (already synced): {os.path.basename(file_path)}")
+                    continue
+                validated.append((file_path, *checked))
+
+            if not validated:
+                return
+
+            for file_path, abs_file_path, file_stat in validated:
+                logging.info(f"Syncing file: {abs_file_path} ({file_stat.st_size / (1024*1024):.2f} MB)")
 
             # SECURITY: Re-validate immediately before rsync to prevent TOCTOU race condition
             # This closes the window where file could be replaced with symlink after validation
-            if os.path.islink(abs_file_path):
-                logging.error(f"Security: File became symlink after validation: {file_path}")
-                return
+            batch = [
+                (file_path, abs_file_path, file_stat)
+                for file_path, abs_file_path, file_stat in validated
+                if self._revalidate_file(file_path, abs_file_path, file_stat)
+            ]
 
-            if not os.path.isfile(abs_file_path):
-                logging.error(f"Security: File changed type after validation: {file_path}")
+            if not batch:
                 return
 
-            if not abs_file_path.endswith('.gcode'):
-                logging.error(f"Security: File extension changed after validation: {file_path}")
-                return
+            batch_paths = [abs_file_path for _, abs_file_path, _ in batch]
+            total_size = sum(file_stat.st_size for _, _, file_stat in batch)
+            batch_label = ", ".join(os.path.basename(path) for path in batch_paths)
 
-            # Calculate dynamic timeout based on file size
+            # Calculate dynamic timeout based on total batch size
             # Baseline: 2 minutes for small files, add 1 minute per 100 MB for large files
-            timeout_seconds = max(RSYNC_TOTAL_TIMEOUT, int((file_size / (100 * 1024 * 1024)) * 60))
+            timeout_seconds = max(RSYNC_TOTAL_TIMEOUT, int((total_size / (100 * 1024 * 1024)) * 60))
 
-            logging.debug(f"Using timeout: {timeout_seconds}s for {file_size / (1024*1024):.2f} MB file")
+            logging.debug("Using timeout: %ds for %.2f MB batch", timeout_seconds, total_size / (1024*1024))
 
-            # Build rsync command with timeouts
+            # Names go to rsync on stdin, so a large burst never hits the argv limit
+            file_list = "".join(f"{os.path.relpath(path, ABS_WATCH_DIR)}\0" for path in batch_paths)
+
+            # Build rsync command with timeouts; all files share one connection and file list
             rsync_cmd = [
-                "rsync",
+                RSYNC_BIN,
                 "--stats",
                 "--protect-args",
-                "-avz",
+                # -z negotiates zstd when both ends run rsync >= 3.2
+                *RSYNC_TRANSFER_FLAGS,
+                # Keep interrupted uploads out of sight; only the delta (non -W) path resumes them
+                "--partial-dir=.rsync-partial",
                 f"--timeout={RSYNC_TIMEOUT}",
-                "-e", f"ssh -p {REMOTE_PORT} -o StrictHostKeyChecking=yes -o ConnectTimeout=10 -o ServerAliveInterval=5 -o ServerAliveCountMax=3",
-                abs_file_path,
-                f"{REMOTE_USER}@{REMOTE_HOST}:{shlex.quote(REMOTE_PATH if REMOTE_PATH.endswith('/') else f'{REMOTE_PATH}/')}"
+                "-e", " ".join(shlex.quote(arg) for arg in [SSH_BIN, *SSH_CLIENT_OPTIONS]),
+                "--files-from=-", "--from0", "--no-relative",
+                f"{ABS_WATCH_DIR}/",
+                rsync_destination()
             ]
 
             # Execute rsync with retry logic (handles transient network failures)
             # Execute rsync immediately after re-validation (minimize TOCTOU window)
             sync_start = time.monotonic()
-            result, attempts_used = self._execute_rsync_with_retry(rsync_cmd, timeout_seconds)
+            result, attempts_used = self._execute_rsync_with_retry(rsync_cmd, timeout_seconds, file_list)
             duration = max(time.monotonic() - sync_start, 1e-6)
-            mb_size = file_size / (1024 * 1024)
+            mb_size = total_size / (1024 * 1024)
             transfer_rate = mb_size / duration if duration > 0 else float('inf')
 
-            logging.info(f"Successfully synced: {os.path.basename(abs_file_path)}")
+            for file_path, abs_file_path, file_stat in batch:
+                self.synced[file_path] = (file_stat.st_size, file_stat.st_mtime_ns)
+                logging.info(f"Successfully synced: {os.path.basename(abs_file_path)}")
 
-            # Trigger USB gadget refresh
-            usb_refresh_success = self.refresh_usb_gadget()
+            # Trigger USB gadget refresh once per batch (deferred if other syncs are still running)
+            usb_refresh_success = self._refresh_if_last()
 
             stats = parse_rsync_stats(getattr(result, "stdout", ""))
             total_bytes_sent = stats.get("total_bytes_sent")
@@ -404,7 +976,10 @@ class GCodeHandler(FileSystemEventHandler):
             matched_data = stats.get("matched_data")
             speedup_value = stats.get("speedup")
 
-            refresh_status = "ok" if usb_refresh_success else "failed"
+            if usb_refresh_success is None:
+                refresh_status = "deferred"
+            else:
+                refresh_status = "ok" if usb_refresh_success else "failed"
             rate_display = "inf" if transfer_rate == float('inf') else f"{transfer_rate:.2f}"
             bytes_sent_display = total_bytes_sent if total_bytes_sent is not None else "n/a"
             bytes_received_display = total_bytes_received if total_bytes_received is not None else "n/a"
@@ -414,7 +989,7 @@ class GCodeHandler(FileSystemEventHandler):
 
             summary_block = "\n".join([
                 "==================== Sync Summary ====================",
-                f" File           : {os.path.basename(abs_file_path)}",
+                f" File           : {batch_label}",
                 f" Size           : {mb_size:.2f} MB",
                 f" Duration       : {duration:.2f} s",
                 f" Average Rate   : {rate_display} MB/s",
@@ -429,24 +1004,32 @@ class GCodeHandler(FileSystemEventHandler):
             ])
             logging.info(summary_block)
 
-        except subprocess.TimeoutExpired:
-            logging.error(f"Timeout syncing {file_path} - transfer took longer than 2 minutes")
+        except subprocess.TimeoutExpired as e:
+            logging.error(f"Timeout syncing {batch_label} - transfer took longer than {e.timeout} seconds")
         except subprocess.CalledProcessError as e:
-            logging.error(f"Failed to sync {file_path}: {e}")
+            logging.error(f"Failed to sync {batch_label}: {e}")
             logging.error(f"STDERR: {e.stderr}")
         except Exception as e:
-            logging.error(f"Unexpected error syncing {file_path}: {e}")
+            logging.error(f"Unexpected error syncing {batch_label}: {e}")
         finally:
             with self.syncing_lock:
-                self.syncing.discard(file_path)
+                self._active_syncs -= 1
+                run_deferred_refresh = self._active_syncs == 0 and self._refresh_pending
+                if run_deferred_refresh:
+                    self._refresh_pending = False
+
+            if run_deferred_refresh:
+                self._run_refresh()
 
     @retry_on_failure()
-    def _execute_rsync_with_retry(self, rsync_cmd: List[str], timeout_seconds: int) -> subprocess.CompletedProcess:
+    def _execute_rsync_with_retry(self, rsync_cmd: List[str], timeout_seconds: int,
+                                  file_list: str = "") -> subprocess.CompletedProcess:
         """Execute rsync command with retry logic for transient failures.
 
         Args:
             rsync_cmd: List of command arguments for rsync
             timeout_seconds: Timeout in seconds for the operation
+            file_list: Data fed to rsync's stdin (the --files-from=- list)
 
         Returns:
             Tuple[subprocess.CompletedProcess, int]: Result of the rsync operation and
@@ -456,13 +1039,20 @@ class GCodeHandler(FileSystemEventHandler):
             subprocess.CalledProcessError: If rsync fails after all retries
             subprocess.TimeoutExpired: If rsync times out after all retries
         """
-        return subprocess.run(
-            rsync_cmd,
-            capture_output=True,
-            text=True,
-            check=True,
-            timeout=timeout_seconds
-        )
+        try:
+            return subprocess.run(
+                rsync_cmd,
+                input=file_list,
+                capture_output=True,
+                text=True,
+                check=True,
+                timeout=timeout_seconds
+            )
+        except subprocess.CalledProcessError as e:
+            # The retry reuses this list, so point its destination at the new address
+            if e.returncode == SSH_CONNECTION_FAILED and reresolve_remote_host():
+                rsync_cmd[-1] = rsync_destination()
+            raise
 
     @retry_on_failure(max_attempts=3, initial_delay=2, backoff_multiplier=2)
     def _execute_usb_refresh_with_retry(self) -> bool:
@@ -476,26 +1066,29 @@ class GCodeHandler(FileSystemEventHandler):
             subprocess.TimeoutExpired: If refresh times out (triggers retry)
         """
         ssh_cmd = [
-            "ssh",
-            "-p", REMOTE_PORT,
-            "-o", "StrictHostKeyChecking=yes",
-            "-o", "ConnectTimeout=10",
-            "-o", "ServerAliveInterval=5",
-            "-o", "ServerAliveCountMax=3",
-            f"{REMOTE_USER}@{REMOTE_HOST}",
+            SSH_BIN,
+            *SSH_CLIENT_OPTIONS,
+            REMOTE_TARGET,
             "sudo /usr/local/bin/refresh_usb_gadget.sh"
         ]
 
-        result = subprocess.run(
-            ssh_cmd,
-            check=True,
-            capture_output=True,
-            text=True,
-            timeout=USB_REFRESH_TIMEOUT
-        )
+        try:
+            result = subprocess.run(
+                ssh_cmd,
+                check=True,
+                capture_output=True,
+                text=True,
+                timeout=USB_REFRESH_TIMEOUT
+            )
+        except subprocess.CalledProcessError as e:
+            # The retry rebuilds ssh_cmd from REMOTE_TARGET
+            if e.returncode == SSH_CONNECTION_FAILED:
+                reresolve_remote_host()
+            raise
         logging.info("USB gadget refreshed successfully")
-        if result.stdout:
-            logging.debug(f"Refresh output: {result.stdout.strip()}")
+        # Skip stripping the script's output unless DEBUG is actually enabled
+        if result.stdout and logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug("Refresh output: %s", result.stdout.strip())
         return True
 
     def refresh_usb_gadget(self) -> bool:
@@ -529,36 +1122,71 @@ class GCodeHandler(FileSystemEventHandler):
             return False
 
 
-def main() -> None:
-    """Main function"""
-    # Check if watchdog is installed
+def start_ssh_master() -> bool:
+    """Open the shared SSH master connection used by rsync and USB refresh.
+
+    Failure is not fatal: clients fall back to direct connections when no
+    master socket exists.
+
+    Returns:
+        bool: True if the master connection was established
+    """
     try:
-        import watchdog
-    except ImportError:
-        logging.warning("watchdog module not found. Installing...")
-        req_file = SCRIPT_DIR / "requirements.txt"
-        uv_exe = shutil.which("uv")
+        SSH_CONTROL_DIR.mkdir(parents=True, mode=0o700, exist_ok=True)
+        # -f backgrounds ssh after authentication; its output must not be piped,
+        # otherwise the backgrounded master would hold the pipes open.
+        result = subprocess.run(
+            [
+                SSH_BIN, "-MNf",
+                *SSH_OPTIONS,
+                "-o", "ControlMaster=yes",
+                "-o", f"ControlPersist={SSH_CONTROL_PERSIST}",
+                REMOTE_TARGET,
+            ],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            timeout=SSH_MASTER_TIMEOUT
+        )
+    except (OSError, subprocess.TimeoutExpired) as e:
+        logging.warning(f"Could not start SSH master connection: {type(e).__name__}: {e}")
+        return False
+
+    if result.returncode != 0:
+        logging.warning(f"Could not start SSH master connection (exit code {result.returncode})")
+        logging.warning("Falling back to one SSH connection per sync")
+        return False
+
+    global SSH_MASTER_TARGET
+    SSH_MASTER_TARGET = REMOTE_TARGET
+    logging.info(f"SSH master connection established ({SSH_CONTROL_DIR})")
+    return True
+
+
+def stop_ssh_master() -> None:
+    """Tear down the shared SSH master connection(s), if any are running.
+
+    Besides the master opened at startup, a client (ControlMaster=auto) may have
+    become the master for a newer REMOTE_TARGET after the address was re-resolved.
+    """
+    for target in dict.fromkeys(t for t in (SSH_MASTER_TARGET, REMOTE_TARGET) if t):
         try:
-            if uv_exe:
-                logging.info("Using uv to install Python dependencies")
-                if req_file.exists():
-                    subprocess.run([uv_exe, "pip", "install", "-r", str(req_file)], check=True)
-                else:
-                    subprocess.run([uv_exe, "pip", "install", "watchdog==3.0.0"], check=True)
-            else:
-                logging.info("Using pip to install Python dependencies")
-                if req_file.exists():
-                    subprocess.run([sys.executable, "-m", "pip", "install", "-r", str(req_file)], check=True)
-                else:
-                    subprocess.run([sys.executable, "-m", "pip", "install", "watchdog==3.0.0"], check=True)
-
-            logging.info("Installation successful. Reloading module...")
-            # Dynamic import after installation
-            import watchdog
-            logging.info("watchdog module loaded successfully. Continuing...")
-        except subprocess.CalledProcessError as e:
-            logging.error(f"Failed to install watchdog: {e}")
-            logging.error("Please install manually: pip install -r requirements.txt")
+            subprocess.run(
+                [SSH_BIN, *SSH_OPTIONS, "-O", "exit", target],
+                capture_output=True,
+                timeout=SSH_MASTER_TIMEOUT
+            )
+        except (OSError, subprocess.TimeoutExpired) as e:
+            logging.debug("Could not stop SSH master connection: %s", e)
+
+
+def main() -> None:
+    """Main function"""
+    # Fail fast if the transfer tools are missing instead of failing every sync
+    for tool in (RSYNC_BIN, SSH_BIN):
+        if shutil.which(tool) is None:
+            logging.error(f"Required program not found: {tool}")
+            logging.error("Install rsync and OpenSSH client, then restart the monitor")
             sys.exit(1)
 
     # Create watch directory if it doesn't exist
@@ -567,24 +1195,49 @@ def main() -> None:
     logging.info(f"Starting gcode file monitor on {WATCH_DIR}")
     logging.info(f"Will sync to {REMOTE_USER}@{REMOTE_HOST}:{REMOTE_PORT}:{REMOTE_PATH}")
 
+    start_ssh_master()
+    # Any client may have become the master (ControlMaster=auto), so tear it
+    # down even if main() is left through an exception instead of a signal
+    atexit.register(stop_ssh_master)
+
     # Setup file system observer
-    event_handler = GCodeHandler()
-    observer = Observer()
+    observer_class = select_observer(WATCH_DIR)
+    event_handler = GCodeHandler(close_events=close_events_supported(observer_class),
+                                 state_file=SYNC_STATE_FILE)
+    event_handler.start()
+    observer = observer_class()
     observer.schedule(event_handler, WATCH_DIR, recursive=False)
 
+    # Ctrl+C and systemd's SIGTERM stop the observer, which ends the join below
+    stop_requested = threading.Event()
+
+    def request_stop(signum: int, frame: Any) -> None:
+        if not stop_requested.is_set():
+            stop_requested.set()
+            logging.info("Stopping monitor...")
+            observer.stop()
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
     # Start monitoring
     observer.start()
     logging.info("Monitoring for new .gcode files... (Press Ctrl+C to stop)")
 
-    try:
-        while True:
-            time.sleep(1)
-    except KeyboardInterrupt:
-        logging.info("Stopping monitor...")
-        observer.stop()
-
+    # Block on the observer thread itself: no periodic wakeups, and if it
+    # ever exits on its own the monitor exits too instead of idling forever
     observer.join()
+    exit_code = 0
+    if not stop_requested.is_set():
+        logging.error("File system observer stopped unexpectedly")
+        exit_code = 1
+
+    event_handler.close()
+    atexit.unregister(stop_ssh_master)
+    stop_ssh_master()
     logging.info("Monitor stopped")
+    if exit_code:
+        sys.exit(exit_code)
 
 
 if __name__ == "__main__":
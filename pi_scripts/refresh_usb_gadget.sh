@@ -42,7 +42,7 @@ if [ -d "/sys/kernel/config/usb_gadget" ] && [ "$(ls -A /sys/kernel/config/usb_g
         sleep 1
     fi
 
-elif lsmod | grep -q "g_mass_storage"; then
+elif grep -q "^g_mass_storage " /proc/modules; then
     # Module method
     log "Detected: g_mass_storage kernel module"
 
@@ -12,7 +12,7 @@ log() {
 }
 
 # Check if g_mass_storage is loaded
-if ! lsmod | grep -q "g_mass_storage"; then
+if ! grep -q "^g_mass_storage " /proc/modules; then
     log "ERROR: g_mass_storage module is not loaded"
     exit 1
 fi
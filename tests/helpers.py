@@ -0,0 +1,78 @@
+"""Helpers shared by the security and integration test suites.
+
+Repository files are read, parsed and stat()ed at most once per test run.
+Their paths are relative to the repository root, not the working directory.
+"""
+
+import functools
+import os
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+@functools.lru_cache(maxsize=None)
+def read_text(path: str) -> str:
+    """Return the contents of a repository file, read once per test run."""
+    with open(REPO_ROOT / path, 'r') as f:
+        return f.read()
+
+
+@functools.lru_cache(maxsize=None)
+def parse_unit(path: str) -> Dict[str, Dict[str, List[str]]]:
+    """Parse a systemd unit into {section: {key: [values]}}, once per test run.
+
+    Repeated keys accumulate the way systemd applies them, which
+    configparser (last value wins) cannot represent.
+    """
+    unit: Dict[str, Dict[str, List[str]]] = {}
+    section = None
+    for line in read_text(path).splitlines():
+        line = line.strip()
+        if not line or line[0] in '#;':
+            continue
+        if line.startswith('[') and line.endswith(']'):
+            section = unit.setdefault(line[1:-1], {})
+        elif section is not None and '=' in line:
+            key, value = line.split('=', 1)
+            section.setdefault(key.strip(), []).append(value.strip())
+    return unit
+
+
+@functools.lru_cache(maxsize=None)
+def repo_stat(path: str) -> Optional[os.stat_result]:
+    """Return os.stat() of a repository file (None if missing), once per test run."""
+    try:
+        return os.stat(REPO_ROOT / path)
+    except FileNotFoundError:
+        return None
+
+
+def missing_needles(content: str, *needles: str) -> Set[str]:
+    """Return the needles that do not occur in content.
+
+    Each needle is searched for on its own, so overlapping needles are exact.
+    """
+    return {needle for needle in needles if needle not in content}
+
+
+class SharedTempDirMixin:
+    """One temporary directory per test class, emptied after each test."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls._temp_dir = tempfile.TemporaryDirectory()
+        cls.temp_dir = cls._temp_dir.name
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._temp_dir.cleanup()
+        super().tearDownClass()
+
+    def tearDown(self):
+        for name in os.listdir(self.temp_dir):
+            os.unlink(os.path.join(self.temp_dir, name))
+        super().tearDown()
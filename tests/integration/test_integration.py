@@ -9,8 +9,8 @@ Tests end-to-end workflows:
 """
 
 import unittest
-import tempfile
 import os
+import stat
 import sys
 import time
 import subprocess
@@ -20,13 +20,18 @@ from unittest.mock import patch, MagicMock
 # Add parent directory to path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
 
+from tests.helpers import REPO_ROOT, SharedTempDirMixin, missing_needles, parse_unit, read_text, repo_stat  # noqa: E402
+
+# Default LOG_FILE from config.example, expanded once
+LOG_FILE_PATH = os.path.expanduser('~/.gcode_sync.log')
+
 
 class TestConfigurationLoading(unittest.TestCase):
     """Test configuration file loading and validation"""
 
     def test_config_file_exists(self):
         """Test that config.local exists and is readable"""
-        config_file = Path('config.local')
+        config_file = REPO_ROOT / 'config.local'
 
         if config_file.exists():
             self.assertTrue(config_file.is_file())
@@ -63,42 +68,43 @@ class TestConfigurationLoading(unittest.TestCase):
             if 'WATCH_DIR' in config:
                 path = config['WATCH_DIR']
                 if not path.startswith('/'):
-                    self.assertFalse(Path(path).is_absolute())
+                    self.assertFalse(os.path.isabs(path))
 
 
-class TestFileMonitoring(unittest.TestCase):
+class TestFileMonitoring(SharedTempDirMixin, unittest.TestCase):
     """Test file system monitoring functionality"""
 
     def test_gcode_file_detection(self):
         """Test that .gcode files are detected"""
-        with tempfile.TemporaryDirectory() as temp_dir:
-            # Create a .gcode file
-            gcode_file = os.path.join(temp_dir, 'test.gcode')
-            with open(gcode_file, 'w') as f:
-                f.write('G28\n')
+        # Create a .gcode file
+        gcode_file = os.path.join(self.temp_dir, 'test.gcode')
+        with open(gcode_file, 'w') as f:
+            f.write('G28\n')
 
-            # Verify detection logic
-            self.assertTrue(gcode_file.endswith('.gcode'))
-            self.assertTrue(os.path.isfile(gcode_file))
+        # Verify detection logic
+        self.assertTrue(gcode_file.endswith('.gcode'))
+        self.assertTrue(os.path.isfile(gcode_file))
 
     def test_non_gcode_files_ignored(self):
         """Test that non-.gcode files are ignored"""
-        with tempfile.TemporaryDirectory() as temp_dir:
-            # Create various non-.gcode files
-            non_gcode_files = [
-                'test.txt',
-                'test.py',
-                'README.md',
-                'config.ini'
-            ]
-
-            for filename in non_gcode_files:
-                file_path = os.path.join(temp_dir, filename)
-                with open(file_path, 'w') as f:
-                    f.write('test\n')
-
-                # Should not be processed
-                self.assertFalse(file_path.endswith('.gcode'))
+        # Create various non-.gcode files
+        non_gcode_files = [
+            'test.txt',
+            'test.py',
+            'README.md',
+            'config.ini'
+        ]
+
+        for filename in non_gcode_files:
+            Path(self.temp_dir, filename).touch()
+
+        # One directory read; DirEntry.is_file() reuses the type from readdir
+        entries = list(os.scandir(self.temp_dir))
+        self.assertEqual(len(entries), len(non_gcode_files))
+        for entry in entries:
+            self.assertTrue(entry.is_file())
+            # Should not be processed
+            self.assertFalse(entry.name.endswith('.gcode'))
 
     def test_file_settle_delay(self):
         """Test that FILE_SETTLE_DELAY prevents processing incomplete files"""
@@ -112,26 +118,19 @@ class TestFileMonitoring(unittest.TestCase):
 class TestNetworkConnectivity(unittest.TestCase):
     """Test network connectivity checks"""
 
-    def test_ssh_connectivity_check(self):
-        """Test SSH connectivity validation"""
+    def test_network_constants(self):
+        """Test SSH connectivity targets and network timeout"""
         # From lib/error_handler.sh check_network function
-
-        # Valid scenarios
-        valid_hosts = ['192.168.1.6', 'localhost']
-        valid_ports = [22, 2222]
-
-        for host in valid_hosts:
-            self.assertIsNotNone(host)
-
-        for port in valid_ports:
-            self.assertGreater(port, 0)
-            self.assertLess(port, 65536)
-
-    def test_network_timeout_configured(self):
-        """Test that network operations have timeouts"""
         # SSH connection should timeout
         connect_timeout = 10
 
+        # Valid scenarios
+        for host, port in [('192.168.1.6', 22), ('localhost', 2222)]:
+            with self.subTest(host=host, port=port):
+                self.assertIsNotNone(host)
+                self.assertGreater(port, 0)
+                self.assertLess(port, 65536)
+
         # Verify timeout is reasonable
         self.assertGreater(connect_timeout, 0)
         self.assertLess(connect_timeout, 60)
@@ -140,50 +139,32 @@ class TestNetworkConnectivity(unittest.TestCase):
 class TestRetryLogic(unittest.TestCase):
     """Test retry logic integration"""
 
-    def test_retry_on_transient_failure(self):
-        """Test that transient failures are retried"""
+    def test_retry_attempt_limit(self):
+        """Test that transient failures are retried, but not indefinitely"""
         RETRY_MAX_ATTEMPTS = 3
-        RETRY_INITIAL_DELAY = 2
 
-        # Simulate retry sequence
-        attempts = []
-        for i in range(1, RETRY_MAX_ATTEMPTS + 1):
-            attempts.append(i)
+        # Simulate retry sequence; the final attempt raises
+        attempts = list(range(1, RETRY_MAX_ATTEMPTS + 1))
 
-        self.assertEqual(len(attempts), 3)
         self.assertEqual(attempts, [1, 2, 3])
+        self.assertEqual(attempts[-1], RETRY_MAX_ATTEMPTS)
 
     def test_exponential_backoff_delays(self):
         """Test that retry delays follow exponential backoff"""
         RETRY_INITIAL_DELAY = 2
         RETRY_BACKOFF_MULTIPLIER = 2
 
-        delays = []
-        delay = RETRY_INITIAL_DELAY
-
-        for _ in range(3):
-            delays.append(delay)
-            delay *= RETRY_BACKOFF_MULTIPLIER
+        delays = [RETRY_INITIAL_DELAY * RETRY_BACKOFF_MULTIPLIER ** i for i in range(3)]
 
         self.assertEqual(delays, [2, 4, 8])
 
-    def test_permanent_failure_after_max_attempts(self):
-        """Test that permanent failures are not retried indefinitely"""
-        RETRY_MAX_ATTEMPTS = 3
-
-        # After 3 attempts, should raise exception
-        for attempt in range(1, RETRY_MAX_ATTEMPTS + 1):
-            if attempt == RETRY_MAX_ATTEMPTS:
-                # Final attempt - should raise
-                self.assertEqual(attempt, 3)
-
 
 class TestErrorHandling(unittest.TestCase):
     """Test error handling and logging"""
 
     def test_error_logging_to_file(self):
         """Test that errors are logged to file"""
-        log_file = os.path.expanduser('~/.gcode_sync.log')
+        log_file = LOG_FILE_PATH
 
         # Log file should be configured
         self.assertTrue(log_file.endswith('.log'))
@@ -198,8 +179,7 @@ class TestErrorHandling(unittest.TestCase):
 
     def test_error_trap_installed(self):
         """Test that error trap is installed in shell scripts"""
-        with open('lib/error_handler.sh', 'r') as f:
-            content = f.read()
+        content = read_text('lib/error_handler.sh')
 
         # Verify error trap exists
         self.assertIn('trap', content)
@@ -236,29 +216,25 @@ class TestSystemdIntegration(unittest.TestCase):
 
     def test_service_file_exists(self):
         """Test that systemd service file exists"""
-        service_file = Path('gcode-monitor.service')
+        st = repo_stat('gcode-monitor.service')
 
-        self.assertTrue(service_file.exists())
-        self.assertTrue(service_file.is_file())
+        self.assertIsNotNone(st)
+        self.assertTrue(stat.S_ISREG(st.st_mode))
 
     def test_service_restart_policy(self):
         """Test that service has restart policy"""
-        with open('gcode-monitor.service', 'r') as f:
-            content = f.read()
+        service = parse_unit('gcode-monitor.service')['Service']
 
         # Verify restart configuration
-        self.assertIn('Restart=on-failure', content)
-        self.assertIn('RestartSec=', content)
+        self.assertEqual(service['Restart'], ['on-failure'])
+        self.assertIn('RestartSec', service)
 
     def test_service_resource_limits(self):
         """Test that service has resource limits"""
-        with open('gcode-monitor.service', 'r') as f:
-            content = f.read()
+        service = parse_unit('gcode-monitor.service')['Service']
 
         # Verify resource limits
-        self.assertIn('MemoryMax=', content)
-        self.assertIn('CPUQuota=', content)
-        self.assertIn('TasksMax=', content)
+        self.assertEqual({'MemoryMax', 'CPUQuota', 'TasksMax'} - service.keys(), set())
 
 
 class TestEndToEndWorkflow(unittest.TestCase):
@@ -302,8 +278,7 @@ class TestEndToEndWorkflow(unittest.TestCase):
         ]
 
         # Each should prevent sync
-        for failure in validation_failures:
-            self.assertIsNotNone(failure)
+        self.assertTrue(all(validation_failures))
 
     def test_network_failure_workflow(self):
         """Test workflow when network fails"""
@@ -317,11 +292,9 @@ class TestEndToEndWorkflow(unittest.TestCase):
             'SSH authentication failed'
         ]
 
-        # Each should be retried
+        # Each should be retried (3 attempts)
         RETRY_MAX_ATTEMPTS = 3
-        for failure in network_failures:
-            # Would retry 3 times
-            self.assertIsNotNone(failure)
+        self.assertTrue(all(network_failures))
 
 
 class TestShellScriptIntegration(unittest.TestCase):
@@ -329,13 +302,15 @@ class TestShellScriptIntegration(unittest.TestCase):
 
     def test_error_handler_library_sourced(self):
         """Test that error_handler.sh is sourced correctly"""
-        with open('lib/error_handler.sh', 'r') as f:
-            content = f.read()
+        content = read_text('lib/error_handler.sh')
 
         # Verify functions are exported
-        self.assertIn('export -f', content)
-        self.assertIn('log_error', content)
-        self.assertIn('retry_command', content)
+        self.assertEqual(missing_needles(
+            content,
+            'export -f',
+            'log_error',
+            'retry_command',
+        ), set())
 
     def test_shell_script_syntax_valid(self):
         """Test that shell scripts have valid syntax"""
@@ -347,9 +322,9 @@ class TestShellScriptIntegration(unittest.TestCase):
         ]
 
         for script in shell_scripts:
-            if os.path.exists(script):
-                # Would run: bash -n script
-                self.assertTrue(os.path.isfile(script))
+            # Would run: bash -n script
+            st = repo_stat(script)
+            self.assertTrue(st is None or stat.S_ISREG(st.st_mode))
 
 
 if __name__ == '__main__':
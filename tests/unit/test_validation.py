@@ -9,7 +9,9 @@ Tests the security-critical validation logic that prevents:
 """
 
 # noqa: D104
+import atexit
 import os
+import stat
 import sys
 import importlib
 import logging
@@ -17,28 +19,60 @@ import threading
 import tempfile
 import unittest
 import shutil
+import socket
+import subprocess
 import textwrap
 import uuid
+from concurrent.futures import Future
 from pathlib import Path
 from types import SimpleNamespace
 from unittest.mock import patch
 
+from watchdog.events import (
+    DirModifiedEvent,
+    FileClosedEvent,
+    FileCreatedEvent,
+    FileDeletedEvent,
+    FileModifiedEvent,
+    FileMovedEvent,
+)
+
 # Add parent directory to path to import monitor_and_sync
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
 
 
+def _fresh_monitor_module():
+    """Execute monitor_and_sync from scratch without replacing the shared import.
+
+    Only tests that exercise module-level setup need this; everyone else reuses
+    the cached module so its init (config read, logging, watchdog) runs once.
+    """
+    with patch.dict(sys.modules):
+        sys.modules.pop("monitor_and_sync", None)
+        return importlib.import_module("monitor_and_sync")
+
+
+def _stop_log_listener(module):
+    """Stop a fresh module's log listener now instead of at interpreter exit."""
+    # QueueListener.stop() cannot run twice, so drop the atexit hook first
+    atexit.unregister(module.log_listener.stop)
+    module.log_listener.stop()
+
+
+def _norm(p):
+    """Lexically normalise p (abspath), without the per-component lstat of resolve()."""
+    return Path(os.path.abspath(str(p)))
+
+
+# Computed once: every path-validation test compares against the same anchors
+_USER_HOME = Path.home().resolve()
+_FORBIDDEN = tuple(_norm(p) for p in ('/etc', '/var', '/usr', '/bin', '/sbin', '/boot'))
+
+
 class TestPathValidation(unittest.TestCase):
     """Test path validation security checks"""
 
-    def setUp(self):
-        """Set up test fixtures"""
-        self.temp_dir = tempfile.mkdtemp()
-        self.user_home = Path.home()
-
-    def tearDown(self):
-        """Clean up test fixtures"""
-        if os.path.exists(self.temp_dir):
-            os.rmdir(self.temp_dir)
+    user_home = _USER_HOME
 
     def test_path_within_home_directory(self):
         """Test that paths within home directory are accepted"""
@@ -55,16 +89,26 @@ class TestPathValidation(unittest.TestCase):
         watch_dir = Path("/etc")
 
         with self.assertRaises(ValueError):
-            watch_dir.resolve().relative_to(self.user_home)
+            _norm(watch_dir).relative_to(self.user_home)
 
     def test_path_traversal_rejected(self):
         """Test that path traversal sequences are rejected"""
         # Attempt to escape home directory with ../
         watch_dir = Path(self.user_home) / ".." / ".." / "etc"
-        resolved = watch_dir.resolve()
 
         with self.assertRaises(ValueError):
-            resolved.relative_to(self.user_home)
+            _norm(watch_dir).relative_to(self.user_home)
+
+    def test_symlinked_watch_dir_needs_resolve(self):
+        """Only resolve() sees a symlink that points out of the allowed tree"""
+        with tempfile.TemporaryDirectory() as base:
+            link = Path(base) / "Desktop"
+            os.symlink("/etc", link)
+
+            # abspath is purely lexical, so the escape is invisible to it
+            self.assertEqual(_norm(link).relative_to(base), Path("Desktop"))
+            with self.assertRaises(ValueError):
+                link.resolve().relative_to(Path(base).resolve())
 
     def test_relative_path_rejected(self):
         """Test that relative paths are rejected"""
@@ -74,52 +118,76 @@ class TestPathValidation(unittest.TestCase):
 
     def test_forbidden_paths_rejected(self):
         """Test that forbidden system paths are rejected"""
-        forbidden_paths = [
-            Path('/etc'),
-            Path('/var'),
-            Path('/usr'),
-            Path('/bin'),
-            Path('/sbin'),
-            Path('/boot')
-        ]
-
-        for forbidden in forbidden_paths:
+        for forbidden in _FORBIDDEN:
             with self.assertRaises(ValueError):
-                forbidden.resolve().relative_to(self.user_home)
-
+                forbidden.relative_to(self.user_home)
 
-class TestFileSizeValidation(unittest.TestCase):
-    """Test file size validation logic"""
 
-    def test_empty_file_rejected(self):
-        """Test that empty files (0 bytes) are rejected"""
-        MIN_FILE_SIZE = 1
-        file_size = 0
+class TestValidateWatchPath(unittest.TestCase):
+    """validate_watch_path(): containment is decided on the fully resolved path"""
 
-        self.assertLess(file_size, MIN_FILE_SIZE)
+    def setUp(self):
+        self.filehandler_patch = patch("logging.FileHandler", return_value=logging.NullHandler())
+        self.filehandler_patch.start()
+        self.addCleanup(self.filehandler_patch.stop)
 
-    def test_oversized_file_rejected(self):
-        """Test that files over 1GB are rejected"""
-        MAX_FILE_SIZE = 1024 * 1024 * 1024  # 1 GB
-        file_size = MAX_FILE_SIZE + 1
+        self.module = importlib.import_module("monitor_and_sync")
+        self.home = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.home, ignore_errors=True)
+
+    def test_plain_directory_accepted(self):
+        desktop = os.path.join(self.home, "Desktop")
+        os.mkdir(desktop)
+        self.assertEqual(self.module.validate_watch_path(desktop, self.home), Path(os.path.realpath(desktop)))
+
+    def test_missing_directory_accepted(self):
+        missing = os.path.join(self.home, "not-created-yet")
+        self.assertEqual(self.module.validate_watch_path(missing, self.home), Path(os.path.realpath(missing)))
+
+    def test_relative_and_outside_paths_rejected(self):
+        for path in ("Desktop", "/etc", self.home + "-sibling"):
+            with self.subTest(path=path), self.assertRaises(ValueError):
+                self.module.validate_watch_path(path, self.home)
+
+    def test_symlink_leaf_resolved_before_containment(self):
+        inside = os.path.join(self.home, "Prints")
+        os.mkdir(inside)
+        good_link = os.path.join(self.home, "Desktop")
+        bad_link = os.path.join(self.home, "Escape")
+        os.symlink(inside, good_link)
+        os.symlink("/etc", bad_link)
+
+        self.assertEqual(self.module.validate_watch_path(good_link, self.home), Path(os.path.realpath(inside)))
+        with self.assertRaises(ValueError):
+            self.module.validate_watch_path(bad_link, self.home)
 
-        self.assertGreater(file_size, MAX_FILE_SIZE)
+    def test_symlinked_parent_directory_rejected(self):
+        # <home>/evil -> /etc: only the leaf "ssl" is a real directory
+        os.symlink("/etc", os.path.join(self.home, "evil"))
+        with self.assertRaises(ValueError):
+            self.module.validate_watch_path(os.path.join(self.home, "evil", "ssl"), self.home)
 
-    def test_large_file_warning(self):
-        """Test that files over 500MB trigger warning"""
-        WARN_FILE_SIZE = 500 * 1024 * 1024  # 500 MB
-        file_size = WARN_FILE_SIZE + 1
 
-        self.assertGreater(file_size, WARN_FILE_SIZE)
+class TestFileSizeValidation(unittest.TestCase):
+    """Test file size validation logic"""
 
-    def test_normal_file_accepted(self):
-        """Test that normal-sized files (1MB) are accepted"""
+    def test_file_size_bounds(self):
+        """Test accept/warn decisions at and around the size limits"""
         MIN_FILE_SIZE = 1
-        MAX_FILE_SIZE = 1024 * 1024 * 1024
-        file_size = 1024 * 1024  # 1 MB
+        MAX_FILE_SIZE = 1024 * 1024 * 1024  # 1 GB
+        WARN_FILE_SIZE = 500 * 1024 * 1024  # 500 MB
 
-        self.assertGreater(file_size, MIN_FILE_SIZE)
-        self.assertLess(file_size, MAX_FILE_SIZE)
+        # (size, accepted, warns)
+        cases = [
+            (0, False, False),                   # empty file
+            (1024 * 1024, True, False),          # normal 1 MB file
+            (WARN_FILE_SIZE + 1, True, True),    # large file: accepted with warning
+            (MAX_FILE_SIZE + 1, False, True),    # over 1 GB
+        ]
+        for size, accepted, warns in cases:
+            with self.subTest(size=size):
+                self.assertIs(MIN_FILE_SIZE <= size <= MAX_FILE_SIZE, accepted)
+                self.assertIs(size > WARN_FILE_SIZE, warns)
 
     def test_dynamic_timeout_calculation(self):
         """Test dynamic timeout calculation based on file size"""
@@ -159,20 +227,25 @@ class TestFileTypeValidation(unittest.TestCase):
 
     def test_symlink_rejected(self):
         """Test that symlinks are rejected"""
-        # Create temporary file and symlink
-        with tempfile.NamedTemporaryFile(suffix='.gcode', delete=False) as f:
-            real_file = f.name
+        # Feed the handler lstat() modes rather than creating files
+        # (real symlinks are covered in tests/security and TestRevalidation)
+        with patch("logging.FileHandler", return_value=logging.NullHandler()):
+            module = importlib.import_module("monitor_and_sync")
+        handler = module.GCodeHandler()
+        self.addCleanup(handler.close)
+        link_path = os.path.join(module.ABS_WATCH_DIR, "link.gcode")
+        real_path = os.path.join(module.ABS_WATCH_DIR, "real.gcode")
 
-        symlink_path = real_file + '.link'
+        def fake_lstat(path):
+            mode = stat.S_IFLNK if path == link_path else stat.S_IFREG
+            return os.stat_result((mode | 0o644,) + (0,) * 5 + (1024,) + (0,) * 3)
 
-        try:
-            os.symlink(real_file, symlink_path)
+        with patch("monitor_and_sync.os.lstat", side_effect=fake_lstat):
+            with self.assertLogs(level="ERROR") as logs:
+                self.assertIsNone(handler._validate_file(link_path))
+            self.assertEqual(handler._validate_file(real_path)[0], real_path)
 
-            self.assertTrue(os.path.islink(symlink_path))
-            self.assertFalse(os.path.islink(real_file))
-        finally:
-            os.unlink(symlink_path)
-            os.unlink(real_file)
+        self.assertIn("Refusing to sync symlink", logs.output[0])
 
     def test_directory_rejected(self):
         """Test that directories are rejected"""
@@ -181,6 +254,45 @@ class TestFileTypeValidation(unittest.TestCase):
             self.assertTrue(os.path.isdir(temp_dir))
 
 
+class TestRevalidation(unittest.TestCase):
+    """Test the pre-transfer TOCTOU re-check"""
+
+    def setUp(self):
+        self.filehandler_patch = patch("logging.FileHandler", return_value=logging.NullHandler())
+        self.filehandler_patch.start()
+        self.addCleanup(self.filehandler_patch.stop)
+
+        self.module = importlib.import_module("monitor_and_sync")
+        self.handler = self.module.GCodeHandler()
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir, ignore_errors=True)
+        self.file_path = os.path.join(self.temp_dir, "part.gcode")
+        with open(self.file_path, "w", encoding="utf-8") as f:
+            f.write("G28\n")
+        self.file_stat = os.lstat(self.file_path)
+
+    def _revalidate(self):
+        return self.handler._revalidate_file(self.file_path, self.file_path, self.file_stat)
+
+    def test_unchanged_file_accepted(self):
+        self.assertTrue(self._revalidate())
+
+    def test_file_swapped_for_symlink_rejected(self):
+        target = os.path.join(self.temp_dir, "target.gcode")
+        os.rename(self.file_path, target)
+        os.symlink(target, self.file_path)
+
+        self.assertFalse(self._revalidate())
+
+    def test_file_replaced_after_validation_rejected(self):
+        replacement = os.path.join(self.temp_dir, "replacement.gcode")
+        with open(replacement, "w", encoding="utf-8") as f:
+            f.write("G1 X10\n")
+        os.replace(replacement, self.file_path)
+
+        self.assertFalse(self._revalidate())
+
+
 class TestRetryLogic(unittest.TestCase):
     """Test retry decorator logic"""
 
@@ -191,11 +303,7 @@ class TestRetryLogic(unittest.TestCase):
         RETRY_BACKOFF_MULTIPLIER = 2
 
         # Calculate expected delays (one delay per retry attempt)
-        delays = []
-        delay = RETRY_INITIAL_DELAY
-        for i in range(RETRY_MAX_ATTEMPTS):
-            delays.append(delay)
-            delay *= RETRY_BACKOFF_MULTIPLIER
+        delays = [RETRY_INITIAL_DELAY * RETRY_BACKOFF_MULTIPLIER ** i for i in range(RETRY_MAX_ATTEMPTS)]
 
         expected_delays = [2, 4, 8]
         self.assertEqual(delays, expected_delays)
@@ -206,12 +314,7 @@ class TestRetryLogic(unittest.TestCase):
         multiplier = 2
         attempts = 3
 
-        delay = initial_delay
-        backoff_sequence = []
-
-        for _ in range(attempts):
-            backoff_sequence.append(delay)
-            delay *= multiplier
+        backoff_sequence = [initial_delay * multiplier ** i for i in range(attempts)]
 
         self.assertEqual(backoff_sequence, [2, 4, 8])
 
@@ -242,31 +345,98 @@ class TestConfigurationConstants(unittest.TestCase):
         self.assertGreater(WARN_FILE_SIZE, MIN_FILE_SIZE)
 
 
+class TestConfigExpansion(unittest.TestCase):
+    """Ensure config values expand like the shell-sourced config.local does."""
+
+    def setUp(self):
+        self.filehandler_patch = patch("logging.FileHandler", return_value=logging.NullHandler())
+        self.filehandler_patch.start()
+        self.addCleanup(self.filehandler_patch.stop)
+
+        self.module = importlib.import_module("monitor_and_sync")
+
+    def test_matches_expandvars_and_expanduser(self):
+        env = {"HOME": "/home/pi", "PRINTS": "prints"}
+        cases = [
+            "$HOME/Desktop",
+            "${HOME}/Desktop",
+            "~/Desktop",
+            "~",
+            "/srv/$PRINTS",
+            "/srv/$UNSET_VAR",
+            "plain-value",
+        ]
+        with patch.dict(os.environ, env, clear=True):
+            for value in cases:
+                with self.subTest(value=value):
+                    expected = os.path.expanduser(os.path.expandvars(value))
+                    self.assertEqual(self.module._expand_config_value(value, env, "/home/pi"), expected)
+
+    def test_plain_values_skip_expansion(self):
+        with patch("monitor_and_sync.string.Template") as mock_template, \
+                patch("monitor_and_sync.os.path.expanduser") as mock_expanduser:
+            self.assertEqual(self.module._expand_config_value("192.168.1.50", {}, "/home/pi"), "192.168.1.50")
+
+        mock_template.assert_not_called()
+        mock_expanduser.assert_not_called()
+
+
 class TestHandlerDeadlock(unittest.TestCase):
-    """Ensure file event handlers do not deadlock when invoking sync_file"""
+    """Ensure event delivery never waits on a running sync"""
 
-    def test_on_created_does_not_deadlock(self):
-        """on_created should return promptly without holding the lock"""
-        # Import here to ensure configuration is loaded as in production
-        sys.modules.pop("monitor_and_sync", None)
+    def setUp(self):
         with patch("logging.FileHandler", return_value=logging.NullHandler()):
-            monitor_and_sync = importlib.import_module("monitor_and_sync")
+            self.module = importlib.import_module("monitor_and_sync")
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir, ignore_errors=True)
+        watch_dir = patch.multiple(self.module, WATCH_DIR=self.temp_dir, ABS_WATCH_DIR=self.temp_dir)
+        watch_dir.start()
+        self.addCleanup(watch_dir.stop)
+
+    def test_event_during_upload_does_not_deadlock(self):
+        """An event for a file being uploaded returns at once and is synced afterwards"""
+        file_path = os.path.join(self.temp_dir, "deadlock_test.gcode")
+        Path(file_path).write_text("G28\n", encoding="utf-8")
+        event = FileClosedEvent(file_path)
+        uploading = threading.Event()
+        release = threading.Event()
+        uploads = []
+
+        def fake_rsync(rsync_cmd, timeout_seconds, file_list):
+            uploads.append(file_list)
+            uploading.set()
+            release.wait(5)
+            return SimpleNamespace(stdout="", returncode=0), 1
+
+        # Real dispatcher, executor and lstat()-based validation; only the transfer is faked
+        handler = self.module.GCodeHandler(close_events=True)
+        with patch.object(handler, "_execute_rsync_with_retry", side_effect=fake_rsync), \
+                patch.object(handler, "refresh_usb_gadget", return_value=True), \
+                patch("monitor_and_sync.time.sleep", return_value=None):
+            handler.start()
+            try:
+                handler.dispatch(event)
+                self.assertTrue(uploading.wait(5), "first upload never started")
 
-        handler = monitor_and_sync.GCodeHandler()
-        file_path = os.path.join(monitor_and_sync.WATCH_DIR, "deadlock_test.gcode")
-        event = SimpleNamespace(is_directory=False, src_path=file_path)
+                # Saved again while the upload still occupies a sync worker
+                Path(file_path).write_text("G28\nG1 X10\n", encoding="utf-8")
+                uploading.clear()
+                worker = threading.Thread(target=handler.dispatch, args=(event,), daemon=True)
+                worker.start()
+                worker.join(timeout=0.5)
+                self.assertFalse(worker.is_alive(), "event delivery blocked behind a running sync")
 
-        with patch("monitor_and_sync.time.sleep", return_value=None), \
-                patch("monitor_and_sync.os.path.exists", return_value=False):
-            worker = threading.Thread(target=handler.on_created, args=(event,), daemon=True)
-            worker.start()
-            worker.join(timeout=0.5)
+                release.set()
+                self.assertTrue(uploading.wait(5), "file changed mid-upload was never re-synced")
+            finally:
+                release.set()
+                handler.close()
 
-        self.assertFalse(worker.is_alive(), "on_created must not deadlock when calling sync_file")
+        self.assertEqual(uploads, ["deadlock_test.gcode\0"] * 2)
 
 
-class TestRsyncDestinationQuoting(unittest.TestCase):
-    """Ensure rsync destination is safely quoted for remote paths."""
+class TestEventDebounce(unittest.TestCase):
+    """Ensure bursts of file events collapse into a single sync."""
 
     def setUp(self):
         self.filehandler_patch = patch("logging.FileHandler", return_value=logging.NullHandler())
@@ -274,10 +444,244 @@ class TestRsyncDestinationQuoting(unittest.TestCase):
         self.addCleanup(self.filehandler_patch.stop)
 
         self.module = importlib.import_module("monitor_and_sync")
+        self.handler = self.module.GCodeHandler()
+        self.addCleanup(self.handler.close)
+        self.file_path = os.path.join(self.module.WATCH_DIR, "debounce_test.gcode")
+
+    def _event(self, path=None):
+        path = path or self.file_path
+        return SimpleNamespace(is_directory=False, src_path=path, dest_path=path)
+
+    def test_event_burst_synced_once(self):
+        with patch("monitor_and_sync.time.monotonic", return_value=100.0):
+            self.handler.on_created(self._event())
+            self.handler.on_modified(self._event())
+            self.handler.on_modified(self._event())
+            self.handler._drain()
+
+        self.assertEqual(len(self.handler.pending), 1)
+
+        with patch("monitor_and_sync.time.monotonic", return_value=100.0 + self.module.FILE_SETTLE_DELAY), \
+                patch.object(self.handler, "executor") as mock_executor:
+            self.handler._flush()
+
+        mock_executor.submit.assert_called_once_with(self.handler.sync_files, [self.file_path])
+        self.assertFalse(self.handler.pending)
+
+    def test_close_write_skips_settle_window(self):
+        with patch("monitor_and_sync.time.monotonic", return_value=100.0) as mock_clock:
+            self.handler.on_created(self._event())
+            self.handler.on_closed(self._event())
+            self.handler._drain()
+
+            mock_clock.return_value = 100.0 + self.module.BATCH_WINDOW
+            self.assertLess(self.module.BATCH_WINDOW, self.module.FILE_SETTLE_DELAY)
+            with patch.object(self.handler, "executor") as mock_executor:
+                self.handler._flush()
+
+        mock_executor.submit.assert_called_once_with(self.handler.sync_files, [self.file_path])
+
+    def test_unsettled_file_not_synced(self):
+        with patch("monitor_and_sync.time.monotonic", return_value=100.0):
+            self.handler.on_created(self._event())
+            self.handler._drain()
+
+            with patch.object(self.handler, "executor") as mock_executor:
+                self.handler._flush()
+
+            # Dispatcher sleeps for exactly the remaining settle time
+            self.assertEqual(self.handler._seconds_until_due(), self.module.FILE_SETTLE_DELAY)
+
+        mock_executor.submit.assert_not_called()
+        self.assertIn(self.file_path, self.handler.pending)
+
+    def test_close_events_mode_completes_created_file_on_close(self):
+        handler = self.module.GCodeHandler(close_events=True)
+        self.addCleanup(handler.close)
+        other = self.file_path.replace("debounce_test", "untouched")
+        with patch("monitor_and_sync.time.monotonic", return_value=100.0) as mock_clock:
+            handler.dispatch(FileCreatedEvent(self.file_path))
+            handler._drain()
+            mock_clock.return_value = 100.5
+            # Writes postpone the created file but never schedule an unknown one
+            handler.dispatch(FileModifiedEvent(self.file_path))
+            handler.dispatch(FileModifiedEvent(other))
+            handler._drain()
+            self.assertEqual(dict(handler.pending), {self.file_path: 100.5 + self.module.FILE_SETTLE_DELAY})
+
+            handler.dispatch(FileClosedEvent(self.file_path))
+            handler._drain()
+            mock_clock.return_value = 100.5 + self.module.BATCH_WINDOW
+
+            with patch.object(handler, "executor") as mock_executor:
+                handler._flush()
+
+        mock_executor.submit.assert_called_once_with(handler.sync_files, [self.file_path])
+
+    def test_close_events_mode_settles_file_moved_in(self):
+        # A rename from outside WATCH_DIR is reported as created, with no close event
+        handler = self.module.GCodeHandler(close_events=True)
+        self.addCleanup(handler.close)
+        with patch("monitor_and_sync.time.monotonic", return_value=100.0) as mock_clock:
+            handler.dispatch(FileCreatedEvent(self.file_path))
+            handler._drain()
+            mock_clock.return_value = 100.0 + self.module.FILE_SETTLE_DELAY
+
+            with patch.object(handler, "executor") as mock_executor:
+                handler._flush()
+
+        mock_executor.submit.assert_called_once_with(handler.sync_files, [self.file_path])
+
+    @unittest.skipUnless(sys.platform.startswith("linux"), "needs the inotify observer")
+    def test_cross_directory_move_synced_by_real_observer(self):
+        from watchdog.observers import Observer
+
+        self.assertTrue(self.module.close_events_supported(Observer))
+        watch_dir = tempfile.mkdtemp()
+        outside_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, watch_dir, ignore_errors=True)
+        self.addCleanup(shutil.rmtree, outside_dir, ignore_errors=True)
+
+        synced = threading.Event()
+        synced_paths = []
+
+        handler = self.module.GCodeHandler(close_events=True)
+
+        def record(paths):
+            synced_paths.extend(paths)
+            synced.set()
+
+        observer = Observer()
+        observer.schedule(handler, watch_dir, recursive=False)
+        with patch.object(handler, "sync_files", side_effect=record):
+            handler.start()
+            observer.start()
+            try:
+                source = os.path.join(outside_dir, "moved.gcode")
+                Path(source).write_text("G28\n", encoding="utf-8")
+                os.rename(source, os.path.join(watch_dir, "moved.gcode"))
+                self.assertTrue(synced.wait(self.module.FILE_SETTLE_DELAY + 5),
+                                "file moved into WATCH_DIR was never synced")
+            finally:
+                observer.stop()
+                observer.join()
+                handler.close()
+
+        self.assertEqual(synced_paths, [os.path.join(watch_dir, "moved.gcode")])
+
+    def test_file_changed_during_upload_is_resynced_after_it(self):
+        upload = Future()
+        with patch("monitor_and_sync.time.monotonic", return_value=100.0) as mock_clock, \
+                patch.object(self.handler, "executor") as mock_executor:
+            mock_executor.submit.return_value = upload
+            self.handler.on_closed(self._event())
+            self.handler._drain()
+            mock_clock.return_value = 101.0
+            self.handler._flush()
+            self.assertIs(self.handler.in_flight[self.file_path], upload)
+
+            # Saved again while the first upload is still running
+            self.handler.on_closed(self._event())
+            self.handler._drain()
+            mock_clock.return_value = 102.0
+            self.handler._flush()
+            self.assertEqual(mock_executor.submit.call_count, 1)
+            self.assertIn(self.file_path, self.handler.pending)
+            self.assertIsNone(self.handler._seconds_until_due())
+
+            upload.set_result(None)
+            self.handler._drain()
+            self.assertNotIn(self.file_path, self.handler.in_flight)
+
+            mock_executor.submit.return_value = Future()
+            self.handler._flush()
+
+        self.assertEqual(mock_executor.submit.call_count, 2)
+
+    def test_completed_files_share_one_batch(self):
+        other_path = os.path.join(self.module.WATCH_DIR, "debounce_test_2.gcode")
+        settling_path = os.path.join(self.module.WATCH_DIR, "debounce_test_3.gcode")
+        with patch.object(self.handler, "executor") as mock_executor:
+            with patch("monitor_and_sync.time.monotonic", return_value=100.0):
+                self.handler.on_closed(self._event())
+                self.handler.on_created(self._event(settling_path))
+            with patch("monitor_and_sync.time.monotonic", return_value=100.3):
+                self.handler.on_closed(self._event(other_path))
+
+            with patch("monitor_and_sync.time.monotonic", return_value=100.0 + self.module.BATCH_WINDOW):
+                self.handler._drain()
+                self.handler._flush()
+
+        mock_executor.submit.assert_called_once_with(self.handler.sync_files, [self.file_path, other_path])
+        self.assertEqual(list(self.handler.pending), [settling_path])
+
+    def test_completed_file_waits_for_batch_window(self):
+        with patch("monitor_and_sync.time.monotonic", return_value=100.0), \
+                patch.object(self.handler, "executor") as mock_executor:
+            self.handler.on_closed(self._event())
+            self.handler._drain()
+            self.handler._flush()
+
+        mock_executor.submit.assert_not_called()
+        self.assertEqual(list(self.handler.pending), [self.file_path])
+
+    def test_dispatcher_thread_submits_batch(self):
+        submitted = threading.Event()
+        handler = self.module.GCodeHandler()
+        self.addCleanup(handler.close)
+
+        with patch.object(handler, "executor") as mock_executor:
+            mock_executor.submit.side_effect = lambda *args: submitted.set() or Future()
+            handler.start()
+            handler.on_closed(self._event())
+            self.assertTrue(submitted.wait(timeout=5), "dispatcher never flushed the closed file")
+
+        mock_executor.submit.assert_called_once_with(handler.sync_files, [self.file_path])
+
+    def test_irrelevant_events_dropped_before_dispatch(self):
+        handler = self.module.GCodeHandler()
+        self.addCleanup(handler.close)
+        temp_path = self.file_path + ".tmp"
+        events = [
+            FileCreatedEvent(temp_path),
+            FileModifiedEvent(self.file_path + ".swp"),
+            FileClosedEvent(temp_path),
+            FileDeletedEvent(self.file_path),
+            DirModifiedEvent(self.module.WATCH_DIR),
+            FileMovedEvent(self.file_path, temp_path),
+        ]
+        with patch.object(handler, "_schedule") as mock_schedule:
+            for event in events:
+                handler.dispatch(event)
+            mock_schedule.assert_not_called()
+
+            handler.dispatch(FileMovedEvent(temp_path, self.file_path))
+
+        mock_schedule.assert_called_once_with(self.file_path, delay=self.module.BATCH_WINDOW, complete=True)
+
+
+class TestRsyncDestinationQuoting(unittest.TestCase):
+    """Ensure rsync destination is safely quoted for remote paths."""
+
+    @classmethod
+    def setUpClass(cls):
+        with patch("logging.FileHandler", return_value=logging.NullHandler()):
+            cls.module = importlib.import_module("monitor_and_sync")
+
+    def setUp(self):
         self.temp_dir = tempfile.mkdtemp()
-        self.original_watch_dir = self.module.WATCH_DIR
-        self.original_remote_path = self.module.REMOTE_PATH
-        self.module.WATCH_DIR = self.temp_dir
+        self.addCleanup(shutil.rmtree, self.temp_dir, ignore_errors=True)
+        # patch.multiple restores the module globals even if a test fails midway
+        module_globals = patch.multiple(self.module, WATCH_DIR=self.temp_dir,
+                                        ABS_WATCH_DIR=os.path.abspath(self.temp_dir),
+                                        REMOTE_PATH=self.module.REMOTE_PATH)
+        module_globals.start()
+        self.addCleanup(module_globals.stop)
+        # Retry backoff and the USB refresh interval must not slow the suite down;
+        # tests that assert on sleeps patch it again locally
+        no_sleep = patch("monitor_and_sync.time.sleep", return_value=None)
+        no_sleep.start()
+        self.addCleanup(no_sleep.stop)
         self.stats_output = textwrap.dedent("""
             Number of files: 1 (reg: 1)
             Number of created files: 1 (reg: 1)
@@ -294,13 +698,6 @@ class TestRsyncDestinationQuoting(unittest.TestCase):
         with open(self.file_path, "w", encoding="utf-8") as f:
             f.write("G1 X0 Y0\n")
 
-    def tearDown(self):
-        self.module.WATCH_DIR = self.original_watch_dir
-        self.module.REMOTE_PATH = self.original_remote_path
-        if self.file_path.exists():
-            self.file_path.unlink()
-        shutil.rmtree(self.temp_dir, ignore_errors=True)
-
     def _run_sync_and_get_command(self, remote_path):
         self.module.REMOTE_PATH = remote_path
         handler = self.module.GCodeHandler()
@@ -308,12 +705,77 @@ class TestRsyncDestinationQuoting(unittest.TestCase):
         with patch.object(handler, "_execute_rsync_with_retry",
                           return_value=(SimpleNamespace(stdout=self.stats_output, returncode=0), 1)) as mock_rsync, \
                 patch.object(handler, "refresh_usb_gadget", return_value=True), \
-                patch("monitor_and_sync.time.sleep", return_value=None), \
                 patch("monitor_and_sync.os.path.islink", return_value=False):
             handler.sync_file(str(self.file_path))
 
         return mock_rsync.call_args[0][0]
 
+    def test_modify_event_after_sync_ignored_until_content_changes(self):
+        handler = self.module.GCodeHandler()
+        self.addCleanup(handler.close)
+        with patch.object(handler, "_execute_rsync_with_retry",
+                          return_value=(SimpleNamespace(stdout=self.stats_output, returncode=0), 1)), \
+                patch.object(handler, "refresh_usb_gadget", return_value=True):
+            handler.sync_file(str(self.file_path))
+
+        event = SimpleNamespace(is_directory=False, src_path=str(self.file_path))
+        with patch.object(handler, "_schedule") as mock_schedule:
+            handler.on_modified(event)
+            mock_schedule.assert_not_called()
+
+            new_mtime = self.file_path.stat().st_mtime_ns + 1_000_000_000
+            os.utime(self.file_path, ns=(new_mtime, new_mtime))
+            handler.on_modified(event)
+
+        mock_schedule.assert_called_once_with(str(self.file_path))
+
+    def test_unchanged_file_not_resent_across_restarts(self):
+        state_file = Path(self.temp_dir) / "state" / "sync_state.json"
+        rsync_result = (SimpleNamespace(stdout=self.stats_output, returncode=0), 1)
+
+        handler = self.module.GCodeHandler(state_file=state_file)
+        with patch.object(handler, "_execute_rsync_with_retry", return_value=rsync_result) as mock_rsync, \
+                patch.object(handler, "refresh_usb_gadget", return_value=True):
+            handler.sync_file(str(self.file_path))
+            handler.sync_file(str(self.file_path))
+        handler.close()
+        self.assertEqual(mock_rsync.call_count, 1)
+        self.assertTrue(state_file.exists())
+
+        restarted = self.module.GCodeHandler(state_file=state_file)
+        self.addCleanup(restarted.close)
+        with patch.object(restarted, "_execute_rsync_with_retry", return_value=rsync_result) as mock_rsync, \
+                patch.object(restarted, "refresh_usb_gadget", return_value=True):
+            restarted.sync_file(str(self.file_path))
+            mock_rsync.assert_not_called()
+
+            with open(self.file_path, "a", encoding="utf-8") as f:
+                f.write("G28\n")
+            restarted.sync_file(str(self.file_path))
+
+        mock_rsync.assert_called_once()
+
+    def test_corrupt_sync_state_ignored(self):
+        state_file = Path(self.temp_dir) / "sync_state.json"
+        state_file.write_text("{not json", encoding="utf-8")
+
+        handler = self.module.GCodeHandler(state_file=state_file)
+        self.addCleanup(handler.close)
+
+        self.assertEqual(handler.synced, {})
+
+    def test_sibling_directory_with_common_prefix_rejected(self):
+        handler = self.module.GCodeHandler()
+        sibling = self.temp_dir + "2"
+        os.makedirs(sibling)
+        self.addCleanup(shutil.rmtree, sibling, ignore_errors=True)
+        sibling_file = os.path.join(sibling, "escape.gcode")
+        with open(sibling_file, "w", encoding="utf-8") as f:
+            f.write("G28\n")
+
+        self.assertIsNone(handler._validate_file(sibling_file))
+        self.assertIsNotNone(handler._validate_file(str(self.file_path)))
+
     def test_remote_path_with_space_is_quoted(self):
         rsync_cmd = self._run_sync_and_get_command("/mnt/usb share")
         destination = rsync_cmd[-1]
@@ -329,6 +791,132 @@ class TestRsyncDestinationQuoting(unittest.TestCase):
         self.assertIn("--protect-args", rsync_cmd)
         self.assertTrue(destination.endswith("--gcode/"))
 
+    def test_interrupted_uploads_kept_in_hidden_partial_dir(self):
+        rsync_cmd = self._run_sync_and_get_command("/mnt/usb_share")
+        self.assertIn("--partial-dir=.rsync-partial", rsync_cmd)
+        # In-place writes would expose truncated files to the printer
+        self.assertNotIn("--inplace", rsync_cmd)
+
+    def test_batch_uses_single_rsync(self):
+        handler = self.module.GCodeHandler()
+        second_file = Path(self.temp_dir) / "second.gcode"
+        second_file.write_text("G28\n", encoding="utf-8")
+
+        with patch.object(handler, "_execute_rsync_with_retry",
+                          return_value=(SimpleNamespace(stdout=self.stats_output, returncode=0), 1)) as mock_rsync, \
+                patch.object(handler, "refresh_usb_gadget", return_value=True) as mock_refresh, \
+                patch("monitor_and_sync.os.path.islink", return_value=False):
+            handler.sync_files([str(self.file_path), str(second_file)])
+
+        mock_rsync.assert_called_once()
+        rsync_cmd, _, file_list = mock_rsync.call_args[0]
+        self.assertIn("--files-from=-", rsync_cmd)
+        self.assertIn("--from0", rsync_cmd)
+        self.assertEqual(rsync_cmd[-2], f"{self.module.ABS_WATCH_DIR}/")
+        self.assertEqual(file_list, "quote_test.gcode\0second.gcode\0")
+        self.assertNotIn(str(self.file_path), rsync_cmd)
+        mock_refresh.assert_called_once_with()
+
+    def test_usb_refresh_coalesced_across_concurrent_syncs(self):
+        handler = self.module.GCodeHandler()
+        second_file = Path(self.temp_dir) / "second.gcode"
+        second_file.write_text("G28\n", encoding="utf-8")
+        rsync_result = (SimpleNamespace(stdout=self.stats_output, returncode=0), 1)
+        calls = []
+
+        def fake_rsync(rsync_cmd, timeout_seconds, file_list):
+            # Second file arrives while the first transfer is still in flight
+            calls.append(rsync_cmd)
+            if len(calls) == 1:
+                handler.sync_file(str(second_file))
+            return rsync_result
+
+        with patch.object(handler, "_execute_rsync_with_retry", side_effect=fake_rsync), \
+                patch.object(handler, "refresh_usb_gadget", return_value=True) as mock_refresh, \
+                patch("monitor_and_sync.os.path.islink", return_value=False):
+            handler.sync_file(str(self.file_path))
+
+        self.assertEqual(len(calls), 2)
+        mock_refresh.assert_called_once_with()
+
+    def test_back_to_back_refreshes_are_rate_limited(self):
+        handler = self.module.GCodeHandler()
+        second_file = Path(self.temp_dir) / "second.gcode"
+        second_file.write_text("G28\n", encoding="utf-8")
+        rsync_result = (SimpleNamespace(stdout=self.stats_output, returncode=0), 1)
+
+        # Fake clock: only moves when the test advances it or the handler sleeps
+        clock = SimpleNamespace(now=100.0)
+
+        def fake_sleep(seconds):
+            clock.now += seconds
+
+        with patch.object(handler, "_execute_rsync_with_retry", return_value=rsync_result), \
+                patch.object(handler, "refresh_usb_gadget", return_value=True) as mock_refresh, \
+                patch("monitor_and_sync.os.path.islink", return_value=False), \
+                patch("monitor_and_sync.time.monotonic", side_effect=lambda: clock.now), \
+                patch("monitor_and_sync.time.sleep", side_effect=fake_sleep) as mock_sleep:
+            handler.sync_file(str(self.file_path))
+            mock_sleep.assert_not_called()
+            self.assertEqual(handler._last_refresh, 100.0)
+
+            clock.now += 2.0
+            handler.sync_file(str(second_file))
+
+        self.assertEqual(mock_refresh.call_count, 2)
+        mock_sleep.assert_called_once_with(self.module.USB_REFRESH_MIN_INTERVAL - 2.0)
+        self.assertEqual(handler._last_refresh, 100.0 + self.module.USB_REFRESH_MIN_INTERVAL)
+
+    def _patch_remote_address(self, address):
+        remote = patch.multiple(self.module, REMOTE_HOST="printer.local", REMOTE_CONNECT_HOST=address,
+                                REMOTE_RSYNC_HOST=address, REMOTE_TARGET=f"test@{address}")
+        remote.start()
+        self.addCleanup(remote.stop)
+
+    def test_connection_failure_reresolves_remote_host(self):
+        self._patch_remote_address("192.168.1.50")
+        handler = self.module.GCodeHandler()
+        rsync_cmd = ["rsync", "src/", self.module.rsync_destination()]
+        destinations = []
+
+        def fake_run(cmd, **kwargs):
+            destinations.append(cmd[-1])
+            if len(destinations) == 1:
+                raise subprocess.CalledProcessError(self.module.SSH_CONNECTION_FAILED, cmd)
+            return SimpleNamespace(stdout=self.stats_output, returncode=0)
+
+        with patch("monitor_and_sync.resolve_host", return_value=["192.168.1.77"]), \
+                patch("monitor_and_sync.subprocess.run", side_effect=fake_run):
+            _, attempts = handler._execute_rsync_with_retry(rsync_cmd, 60, "")
+
+        self.assertEqual(attempts, 2)
+        self.assertIn("@192.168.1.50:", destinations[0])
+        self.assertIn("@192.168.1.77:", destinations[1])
+        self.assertEqual(self.module.REMOTE_TARGET, f"{self.module.REMOTE_USER}@192.168.1.77")
+
+    def test_only_a_single_address_is_pinned(self):
+        with patch.object(self.module, "REMOTE_HOST", "printer.local"):
+            self.assertEqual(self.module.connect_host_for(["192.168.1.50"]), "192.168.1.50")
+            # ssh tries each address itself, e.g. past an unreachable IPv6 one
+            self.assertEqual(self.module.connect_host_for(["fe80::1%eth0", "192.168.1.50"]), "printer.local")
+            self.assertEqual(self.module.connect_host_for([]), "printer.local")
+
+    def test_multiple_addresses_after_failure_fall_back_to_name(self):
+        self._patch_remote_address("192.168.1.50")
+        with patch("monitor_and_sync.resolve_host", return_value=["2001:db8::5", "192.168.1.50"]):
+            self.assertTrue(self.module.reresolve_remote_host())
+        self.assertEqual(self.module.REMOTE_TARGET, f"{self.module.REMOTE_USER}@printer.local")
+
+    def test_unresolvable_host_falls_back_to_name(self):
+        self._patch_remote_address("192.168.1.50")
+        with patch("monitor_and_sync.resolve_host", return_value=[]):
+            self.assertTrue(self.module.reresolve_remote_host())
+        self.assertEqual(self.module.REMOTE_CONNECT_HOST, "printer.local")
+
+        # Same answer again: nothing to change
+        with patch("monitor_and_sync.resolve_host", return_value=[]):
+            self.assertFalse(self.module.reresolve_remote_host())
+
     def test_session_summary_logs_stats(self):
         handler = self.module.GCodeHandler()
         file_path = str(self.file_path)
@@ -336,7 +924,6 @@ class TestRsyncDestinationQuoting(unittest.TestCase):
         with patch.object(handler, "_execute_rsync_with_retry",
                           return_value=(SimpleNamespace(stdout=self.stats_output, returncode=0), 2)), \
                 patch.object(handler, "refresh_usb_gadget", return_value=True), \
-                patch("monitor_and_sync.time.sleep", return_value=None), \
                 patch("monitor_and_sync.os.path.islink", return_value=False), \
                 patch("monitor_and_sync.logging.info") as mock_log_info:
             handler.sync_file(file_path)
@@ -352,18 +939,177 @@ class TestRsyncDestinationQuoting(unittest.TestCase):
         self.assertIn("Speedup        : 1.71", summary_text)
 
 
+class TestLanDetection(unittest.TestCase):
+    """Ensure compression is only used when the printer is off the local network."""
+
+    def setUp(self):
+        self.filehandler_patch = patch("logging.FileHandler", return_value=logging.NullHandler())
+        self.filehandler_patch.start()
+        self.addCleanup(self.filehandler_patch.stop)
+
+        self.module = importlib.import_module("monitor_and_sync")
+
+    def _resolve_to(self, *addresses):
+        addr_info = [(None, None, None, "", (address, 0)) for address in addresses]
+        return patch("monitor_and_sync.socket.getaddrinfo", return_value=addr_info)
+
+    def test_private_addresses_are_lan(self):
+        for address in ("192.168.1.6", "10.0.0.5", "172.16.4.2", "169.254.10.1", "127.0.0.1", "fe80::1%eth0"):
+            with self.subTest(address=address), self._resolve_to(address):
+                self.assertTrue(self.module.is_lan_host("printer"))
+
+    def test_public_or_mixed_addresses_are_not_lan(self):
+        with self._resolve_to("93.184.216.34"):
+            self.assertFalse(self.module.is_lan_host("printer"))
+        with self._resolve_to("192.168.1.6", "93.184.216.34"):
+            self.assertFalse(self.module.is_lan_host("printer"))
+
+    def test_unresolvable_host_is_not_lan(self):
+        with patch("monitor_and_sync.socket.getaddrinfo", side_effect=socket.gaierror("no such host")):
+            self.assertFalse(self.module.is_lan_host("printer.invalid"))
+
+
+class TestObserverSelection(unittest.TestCase):
+    """Ensure network mounts fall back to polling while local disks keep inotify."""
+
+    def setUp(self):
+        self.filehandler_patch = patch("logging.FileHandler", return_value=logging.NullHandler())
+        self.filehandler_patch.start()
+        self.addCleanup(self.filehandler_patch.stop)
+
+        self.module = importlib.import_module("monitor_and_sync")
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir, ignore_errors=True)
+        self.mounts_file = os.path.join(self.temp_dir, "mounts")
+        with open(self.mounts_file, "w", encoding="utf-8") as f:
+            f.write("/dev/root / ext4 rw 0 0\n"
+                    "//nas/prints /mnt/nas\\040share cifs rw 0 0\n"
+                    "nas:/export /mnt/nfs nfs4 rw 0 0\n")
+
+    def test_longest_mount_point_wins(self):
+        cases = {
+            "/home/pi/Desktop": "ext4",
+            "/mnt/nas share/gcode": "cifs",
+            "/mnt/nfs": "nfs4",
+            "/mnt/nfs2": "ext4",
+        }
+        with patch("monitor_and_sync.os.path.realpath", side_effect=lambda path: path):
+            for path, fstype in cases.items():
+                with self.subTest(path=path):
+                    self.assertEqual(self.module.filesystem_type(path, self.mounts_file), fstype)
+
+    def test_network_mount_uses_polling_observer(self):
+        with patch.object(self.module, "filesystem_type", return_value="cifs"):
+            observer_class = self.module.select_observer("/mnt/nas")
+        self.assertIs(observer_class, self.module.PollingObserver)
+        self.assertFalse(self.module.close_events_supported(observer_class))
+
+    def test_local_disk_keeps_default_observer(self):
+        for fstype in ("ext4", None):
+            with self.subTest(fstype=fstype), patch.object(self.module, "filesystem_type", return_value=fstype):
+                self.assertIs(self.module.select_observer("/home/pi/Desktop"), self.module.Observer)
+
+
+class TestSSHMultiplexing(unittest.TestCase):
+    """Ensure rsync and USB refresh share the SSH master connection."""
+
+    def setUp(self):
+        self.filehandler_patch = patch("logging.FileHandler", return_value=logging.NullHandler())
+        self.filehandler_patch.start()
+        self.addCleanup(self.filehandler_patch.stop)
+
+        self.module = importlib.import_module("monitor_and_sync")
+
+    def test_client_options_use_control_socket(self):
+        options = self.module.SSH_CLIENT_OPTIONS
+
+        self.assertIn(f"ControlPath={self.module.SSH_CONTROL_PATH}", options)
+        self.assertIn("ControlMaster=auto", options)
+        self.assertIn(f"ControlPersist={self.module.SSH_CONTROL_PERSIST}", options)
+
+    def test_usb_refresh_reuses_control_socket(self):
+        handler = self.module.GCodeHandler()
+
+        with patch("monitor_and_sync.subprocess.run",
+                   return_value=SimpleNamespace(stdout="", returncode=0)) as mock_run:
+            handler.refresh_usb_gadget()
+
+        ssh_cmd = mock_run.call_args[0][0]
+        self.assertIn(f"ControlPath={self.module.SSH_CONTROL_PATH}", ssh_cmd)
+        self.assertIn("ControlMaster=auto", ssh_cmd)
+
+    def test_connects_to_resolved_address_but_checks_configured_host_key(self):
+        handler = self.module.GCodeHandler()
+
+        with patch("monitor_and_sync.subprocess.run",
+                   return_value=SimpleNamespace(stdout="", returncode=0)) as mock_run:
+            handler.refresh_usb_gadget()
+
+        ssh_cmd = mock_run.call_args[0][0]
+        self.assertIn(self.module.REMOTE_TARGET, ssh_cmd)
+        self.assertIn(f"HostKeyAlias={self.module.SSH_HOST_KEY_ALIAS}", ssh_cmd)
+        self.assertIn(self.module.REMOTE_HOST, self.module.SSH_HOST_KEY_ALIAS)
+
+    def test_key_auth_attempted_first(self):
+        self.assertIn("PreferredAuthentications=publickey", self.module.SSH_CLIENT_OPTIONS)
+
+    def test_identity_file_must_exist(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir, ignore_errors=True)
+        key_file = os.path.join(temp_dir, "id_ed25519")
+        config_lines = [
+            'WATCH_DIR="$HOME/Desktop"',
+            'REMOTE_USER="pi"',
+            'REMOTE_HOST="192.168.1.6"',
+            'REMOTE_PORT="22"',
+            'REMOTE_PATH="/mnt/usb_share"',
+            'LOG_FILE="$HOME/.gcode_sync.log"',
+            f'SSH_IDENTITY_FILE="{key_file}"',
+        ]
+        Path(temp_dir, "config.local").write_text("\n".join(config_lines) + "\n", encoding="utf-8")
+
+        with patch.object(self.module, "SCRIPT_DIR", Path(temp_dir)), \
+                patch("sys.stderr"):
+            with self.assertRaises(SystemExit):
+                self.module.load_config()
+
+            Path(key_file).write_text("key\n", encoding="utf-8")
+            self.assertEqual(self.module.load_config()["SSH_IDENTITY_FILE"], key_file)
+
+    def test_master_failure_is_not_fatal(self):
+        with patch("monitor_and_sync.subprocess.run",
+                   return_value=SimpleNamespace(returncode=255)), \
+                patch.object(Path, "mkdir"):
+            self.assertFalse(self.module.start_ssh_master())
+
+    def test_master_stopped_under_its_original_target(self):
+        started_with = f"{self.module.REMOTE_USER}@192.168.1.50"
+        moved_to = f"{self.module.REMOTE_USER}@192.168.1.77"
+        with patch.multiple(self.module, REMOTE_TARGET=started_with, SSH_MASTER_TARGET=None), \
+                patch("monitor_and_sync.subprocess.run",
+                      return_value=SimpleNamespace(returncode=0)) as mock_run, \
+                patch.object(Path, "mkdir"):
+            self.assertTrue(self.module.start_ssh_master())
+            # The Pi's address changed after startup
+            self.module.REMOTE_TARGET = moved_to
+            mock_run.reset_mock()
+            self.module.stop_ssh_master()
+
+        exit_targets = [c[0][0][-1] for c in mock_run.call_args_list]
+        self.assertEqual(exit_targets, [started_with, moved_to])
+        for c in mock_run.call_args_list:
+            self.assertEqual(c[0][0][-3:-1], ["-O", "exit"])
+
+
 class TestLoggingSetup(unittest.TestCase):
     """Ensure logging setup creates log directory before initializing FileHandler."""
 
     def test_log_directory_precreated_for_filehandler(self):
-        repo_root = Path(__file__).resolve().parents[2]
-        config_path = repo_root / "config.local"
-        original_config = config_path.read_text(encoding="utf-8")
-
         repo_root = Path(__file__).resolve().parents[2]
         temp_root = repo_root / "tmp_log_tests" / uuid.uuid4().hex
         log_dir = temp_root / "logs" / "nested"
         log_file = log_dir / "monitor.log"
+        config_path = temp_root / "config.local"
 
         config_contents = textwrap.dedent(f"""\
             WATCH_DIR="{Path.home()}/Desktop"
@@ -375,23 +1121,58 @@ class TestLoggingSetup(unittest.TestCase):
         """)
 
         try:
+            temp_root.mkdir(parents=True)
             config_path.write_text(config_contents, encoding="utf-8")
-            shutil.rmtree(log_dir, ignore_errors=True)
             self.assertFalse(log_dir.exists(), "Precondition failed: log directory should not exist")
 
-            sys.modules.pop("monitor_and_sync", None)
-
             def fake_filehandler(path, *args, **kwargs):
                 self.assertEqual(str(log_file), path)
                 self.assertTrue(Path(path).parent.exists(), "Log directory should exist before FileHandler initialization")
                 return logging.NullHandler()
 
-            with patch("logging.FileHandler", side_effect=fake_filehandler):
-                importlib.import_module("monitor_and_sync")
+            # Point the module at a private config; the repo's config.local is never touched
+            with patch.dict(os.environ, {"GCODE_MONITOR_CONFIG": str(config_path)}), \
+                    patch("logging.FileHandler", side_effect=fake_filehandler):
+                module = _fresh_monitor_module()
+            _stop_log_listener(module)
         finally:
-            config_path.write_text(original_config, encoding="utf-8")
-            sys.modules.pop("monitor_and_sync", None)
-            shutil.rmtree(temp_root.parent, ignore_errors=True)
+            # The tree is known: at most two files and four directories. Only this
+            # run's directory goes; parallel workers may still be using siblings
+            for path in (config_path, log_file):
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+            for directory in (log_dir, log_dir.parent, temp_root, temp_root.parent):
+                try:
+                    directory.rmdir()
+                except OSError:
+                    pass
+
+    def test_file_and_console_output_run_on_listener_thread(self):
+        file_handler = logging.NullHandler()
+        with patch("logging.FileHandler", return_value=file_handler):
+            module = _fresh_monitor_module()
+        self.addCleanup(_stop_log_listener, module)
+
+        self.assertIn(file_handler, module.log_listener.handlers)
+        self.assertTrue(any(type(h) is logging.StreamHandler for h in module.log_listener.handlers))
+        for handler in module.log_listener.handlers:
+            self.assertIs(handler.formatter, module.log_formatter)
+        self.assertIs(module.log_listener.queue, module.log_queue)
+
+        # Records must reach the listener unformatted apart from %-args
+        record = logging.LogRecord("root", logging.ERROR, __file__, 1, "failed %s", ("x.gcode",), None)
+        self.assertEqual(module.queue_handler.prepare(record).getMessage(), "failed x.gcode")
+
+    def test_listener_stopped_at_exit(self):
+        with patch("logging.FileHandler", return_value=logging.NullHandler()), \
+                patch("atexit.register") as mock_register:
+            module = _fresh_monitor_module()
+        self.addCleanup(module.log_listener.stop)
+
+        # Registered at import, so sys.exit() in main() still flushes queued records
+        mock_register.assert_any_call(module.log_listener.stop)
 
 
 if __name__ == '__main__':